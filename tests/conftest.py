@@ -0,0 +1,7 @@
+import gettext
+
+# The modules use _() from gettext.install(), like xpd.pyw and the cli set up
+gettext.install("xpd")
+
+# Register the controller families
+from xpdm import EB2xx, EB3xx, KH6xx
@@ -0,0 +1,69 @@
+import pytest
+from xpdm import infineon
+
+
+def Tables():
+    for fam in infineon.Families:
+        for desc in fam.ModelDesc:
+            for conv, table in desc["Tables"].items():
+                yield fam, desc, conv, table
+
+
+def test_raw_round_trips():
+    for fam, desc, conv, table in Tables():
+        for raw in range(256):
+            assert table.ToRaw(table.Display[raw]) == raw, (desc["Name"], conv, raw)
+
+
+def test_ties_follow_old_formula():
+    for fam, desc, conv, table in Tables():
+        formula = desc[conv + "2Raw"]
+        for key, lower, upper in zip(table.Keys[1:-1], table.Raws[1:-1], table.Raws[2:]):
+            # The value halfway between two display values, as typed in
+            val = round(key, 6)
+            old = round(formula(val))
+            if old in (lower, upper):
+                assert table.ToRaw(val) == old, (desc["Name"], conv, val)
+
+
+@pytest.mark.parametrize("conv, val", [
+    ("BattCurrent", 15.0), ("BattCurrent", 25.0), ("BattCurrent", 35.0),
+    ("BattCurrent", 45.0), ("PhaseCurrent", 10.0),
+])
+def test_kh6xx_round_values(conv, val):
+    for desc in infineon.FindFamily("KH6").ModelDesc:
+        old = round(desc[conv + "2Raw"](val))
+        if 0 <= old <= 255:
+            assert desc["Tables"][conv].ToRaw(val) == old
+
+
+def test_batch_breaks_ties_like_profile():
+    batch = pytest.importorskip("xpdm.batch")
+    fam = infineon.FindFamily("KH6")
+    profs = []
+    for val in (15.0, 25.0, 35.0, 45.0):
+        prof = fam.CreateProfile("test")
+        prof.BatteryCurrent = val
+        prof.PhaseCurrent = 10.0
+        profs.append(prof)
+    data = batch.ProfileBatch.FromProfiles(fam, profs).BuildRaw()
+    for prof, row in zip(profs, data):
+        assert bytes(row) == bytes(prof.BuildRaw())
+
+
+def test_decode_short_image():
+    data = infineon.FindFamily("EB3").CreateProfile("test").BuildRaw()
+    prof = infineon.FindFamily("KH6").CreateProfile("test")
+    with pytest.raises(ValueError, match="wrong family"):
+        prof.LoadRaw(bytearray(data), None)
+
+
+def test_decode_unknown_ebs_level():
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    data = bytearray(prof.BuildRaw())
+    ofs = [idx for idx, parm, enc, conv in prof.Codec.Encoders if parm == "EBSLevel"][0]
+    data[-1] ^= data[ofs] ^ 3
+    data[ofs] = 3
+    with pytest.raises(ValueError, match="EBS level 3"):
+        fam.CreateProfile("test").LoadRaw(data, None)
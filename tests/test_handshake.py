@@ -0,0 +1,61 @@
+import os
+import asyncio
+import pytest
+from xpdm import infineon, handshake, serialpool
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the emulator needs a pty")
+
+
+def NoProgress(pos=None, msg=None):
+    return True
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    monkeypatch.setattr(handshake, "Stats", handshake.ReadyStats())
+    yield
+    serialpool.Pool.Close()
+
+
+def Upload(prof, port, is_async):
+    if is_async:
+        return asyncio.run(prof.UploadAsync(port, NoProgress))
+    return prof.Upload(port, NoProgress)
+
+
+@pytest.mark.parametrize("family", ["EB2", "EB3", "KH6"])
+@pytest.mark.parametrize("latency", [0.05, 0.15])
+@pytest.mark.parametrize("is_async", [False, True])
+def test_upload_slow_controller(family, latency, is_async):
+    from xpdm import emulator
+
+    fam = infineon.FindFamily(family)
+    prof = fam.CreateProfile("test")
+    with emulator.Emulator(fam, Latency=latency, ReadyDelay=0.3) as emu:
+        assert Upload(prof, emu.Port, is_async)
+        assert emu.Errors == 0
+        assert emu.Image == bytes(prof.BuildRaw())
+
+
+def test_tuned_interval_covers_latency():
+    from xpdm import emulator
+
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    with emulator.Emulator(fam, Latency=0.08, ReadyDelay=0.3) as emu:
+        for i in range(handshake.MIN_SAMPLES + 2):
+            assert prof.Upload(emu.Port, NoProgress)
+            sched = handshake.Schedule(fam.Family, emu.Port)
+            assert sched.Interval >= 0.08
+        assert emu.Errors == 0
+
+    latency = handshake.Stats.Samples(fam.Family, emu.Port, "latency")
+    # Measured from the answered probe, not from a later one
+    assert min(latency) >= 0.08
+
+
+def test_interval_not_below_slowest_reply():
+    for i in range(handshake.MIN_SAMPLES):
+        handshake.Stats.Record("EB3", "port", 1.0, 0.01)
+    handshake.Stats.Record("EB3", "port", 1.0, 0.09)
+    assert handshake.Schedule("EB3", "port").Interval >= 0.09
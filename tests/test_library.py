@@ -0,0 +1,29 @@
+import os
+import shutil
+from xpdm import library
+
+SHARE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "share")
+
+
+def test_scan_survives_malformed_file(tmp_path, monkeypatch):
+    for name in ("6 FET default preset.asv", "12 FET default preset.asv"):
+        shutil.copy(os.path.join(SHARE, name), str(tmp_path))
+    bad = str(tmp_path / "bad.asv")
+    with open(bad, "w") as f:
+        f.write("malformed\r\n")
+
+    load = library.LoadProfile
+
+    def LoadProfile(fn):
+        if fn == bad:
+            # What a family parser might raise on a file it does not expect
+            raise KeyError("ControllerModel")
+        return load(fn)
+
+    monkeypatch.setattr(library, "LoadProfile", LoadProfile)
+    index = library.ProfileIndex(str(tmp_path / "index.json"))
+    rows, errors = index.Scan([str(tmp_path)])
+
+    assert len(rows) == 2
+    assert [fn for fn, msg in errors] == [bad]
+    assert "KeyError" in errors[0][1]
@@ -0,0 +1,32 @@
+import os
+import pytest
+from xpdm import infineon, serialpool
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the emulator needs a pty")
+
+
+def NoProgress(pos=None, msg=None):
+    return True
+
+
+def test_replugged_port_is_reopened(tmp_path, monkeypatch):
+    from xpdm import emulator
+
+    pool = serialpool.SerialPool()
+    monkeypatch.setattr(serialpool, "Pool", pool)
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    # A stable port name which is moved to another device, like a replug
+    port = str(tmp_path / "ttyUSB0")
+    with emulator.Emulator(fam) as first, emulator.Emulator(fam) as second:
+        os.symlink(first.Port, port)
+        assert prof.Upload(port, NoProgress)
+        assert prof.Upload(port, NoProgress)
+        assert pool.Counters["reused"] == 1
+
+        os.unlink(port)
+        os.symlink(second.Port, port)
+        assert prof.Upload(port, NoProgress)
+        assert pool.Counters["opened"] == 2
+        assert second.Uploads == 1
+    pool.Close()
@@ -0,0 +1,106 @@
+import os
+import pytest
+from functools import reduce
+from operator import xor
+from xpdm import infineon, serialpool, transport
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="the emulator needs a pty")
+
+
+def NoProgress(pos=None, msg=None):
+    return True
+
+
+@pytest.fixture(autouse=True)
+def close_ports():
+    yield
+    serialpool.Pool.Close()
+
+
+def Corrupt(image):
+    image = bytearray(image)
+    image[3] ^= 0x10
+    return bytes(image)
+
+
+def test_download_asks_again_for_broken_frame():
+    from xpdm import emulator
+
+    class FlakyEmulator(emulator.Emulator):
+        # The first frame sent is corrupted on the line
+        Flipped = False
+
+        def Send(self, data, delay=True):
+            if (data == self.Image) and not self.Flipped:
+                self.Flipped = True
+                data = Corrupt(data)
+            emulator.Emulator.Send(self, data, delay)
+
+    fam = infineon.FindFamily("KH6")
+    prof = fam.CreateProfile("test")
+    with FlakyEmulator(fam) as emu:
+        assert prof.Download(emu.Port, NoProgress, None)
+        assert emu.Downloads == 2
+    assert bytes(prof.BuildRaw()) == emu.Image
+
+
+def test_download_gives_up_on_broken_frames():
+    from xpdm import emulator
+
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    with emulator.Emulator(fam, Image=Corrupt(prof.BuildRaw())) as emu:
+        with pytest.raises(Exception, match="Broken data"):
+            prof.Download(emu.Port, NoProgress, None)
+        assert emu.Downloads == transport.FRAME_RETRIES + 1
+
+
+def TamperingEmulator(fam, changes):
+    """An emulator which stores the uploaded image with some bytes changed
+    (offset -> value), like a controller which did not take them
+    """
+    from xpdm import emulator
+
+    class Tampering(emulator.Emulator):
+        def FrameDone(self):
+            uploads = self.Uploads
+            emulator.Emulator.FrameDone(self)
+            if self.Uploads > uploads:
+                image = bytearray(self.Image)
+                for ofs, val in changes(image).items():
+                    image[ofs] = val
+                image[-1] = 0
+                image[-1] = reduce(xor, image)
+                self.Image = bytes(image)
+
+    return Tampering(fam)
+
+
+def Offset(prof, parm):
+    return [idx for idx, name, enc, conv in prof.Codec.Encoders if name == parm][0]
+
+
+def test_verify_reports_mismatch_with_uploaded_model():
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    # Shares its raw model code with EB306, but converts currents differently
+    prof.ControllerModel = [d["Name"] for d in fam.ModelDesc].index("EB306/CellMan") + 1
+    prof.PhaseCurrent = 30
+    ofs = Offset(prof, "PhaseCurrent")
+    with TamperingEmulator(fam, lambda image: {ofs: image[ofs] - 1}) as emu:
+        with pytest.raises(infineon.VerifyError) as e:
+            prof.UploadVerify(emu.Port, NoProgress)
+        back = emu.Image[ofs]
+
+    table = prof.GetController()["Tables"]["PhaseCurrent"]
+    assert e.value.Mismatches == [("PhaseCurrent", prof.PhaseCurrent, table.Display[back])]
+
+
+def test_verify_reports_undecodable_byte():
+    fam = infineon.FindFamily("EB3")
+    prof = fam.CreateProfile("test")
+    ofs = Offset(prof, "EBSLevel")
+    with TamperingEmulator(fam, lambda image: {ofs: 3}) as emu:
+        with pytest.raises(infineon.VerifyError) as e:
+            prof.UploadVerify(emu.Port, NoProgress)
+    assert [m[0] for m in e.value.Mismatches] == ["EBSLevel"]
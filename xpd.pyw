@@ -32,6 +32,11 @@ import gettext
 import xpdm
 import locale
 
+# Command line mode does not need GTK at all, see xpdm/cli.py
+if __name__ == "__main__" and len(sys.argv) > 1:
+    from xpdm.cli import main
+    sys.exit(main())
+
 try:
     import gi
     gi.require_version("Gtk", "3.0")
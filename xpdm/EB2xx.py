@@ -4,8 +4,7 @@
 #
 
 import serial
-import locale
-from xpdm import infineon
+from xpdm import infineon, transport, serialpool
 
 # -- # Constants # -- #
 
@@ -248,10 +247,10 @@ This parameter mostly affects the acceleration on low speeds.\
         "Units": _("A"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        # This function converts the raw value to displayed value (in amps)
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2PhaseCurrent"](v),
-        # This function converts the displayed value to raw (when user enters the value directly)
-        "SetDisplay": lambda prof, v: round(prof.GetController()["PhaseCurrent2Raw"](v)),
+        # The controller model conversion (Raw2PhaseCurrent here) which translates
+        # the raw value to displayed value (in amps) and back, through lookup
+        # tables built by infineon.CompileConversions()
+        "Conversion": "PhaseCurrent",
     },
     "BatteryCurrent": {
         "Type": "f",
@@ -266,8 +265,7 @@ energy heating up the battery (and may blow it, too).\
         "Units": _("A"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2BattCurrent"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["BattCurrent2Raw"](v)),
+        "Conversion": "BattCurrent",
     },
     "LowVoltage": {
         "Type": "f",
@@ -285,8 +283,7 @@ the health of your battery.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "LowVoltageTolerance": {
         "Type": "f",
@@ -302,8 +299,7 @@ after a bit of rest.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "SpeedSwitchMode": {
         "Type": "i",
@@ -482,8 +478,7 @@ to prevent blowing out the controller MOSFETs.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "GuardLevel": {
         "Type": "i",
@@ -632,56 +627,21 @@ class Profile(infineon.Profile):
         0,
     ]
 
+    Download = infineon.Profile.Download_EB3xx_KH6xx
+    UploadAsync = transport.Upload_EB2xx
+    DownloadAsync = transport.Download_EB3xx_KH6xx
+
     def __init__(self, Family, FileName):
         infineon.Profile.__init__(self, Family, FileName,
                                   ControllerModelDesc, ControllerParameters)
-        self.Download = self.Download_EB3xx_KH6xx
 
     def OpenSerial(self, com_port):
-        try:
-            return serial.Serial(com_port, 9600, serial.EIGHTBITS, serial.PARITY_NONE,
-                                 serial.STOPBITS_ONE, timeout=0.2)
-        except serial.SerialException as e:
-            raise serial.SerialException(str(e).decode(locale.getpreferredencoding()))
+        return serialpool.Pool.Open(com_port, 9600, serial.EIGHTBITS, serial.PARITY_NONE,
+                                    serial.STOPBITS_ONE, 0.2)
 
     def Upload(self, com_port, progress_func):
-        data = self.BuildRaw()
-        ser = self.OpenSerial(com_port)
-
-        progress_func(msg=_("Waiting for controller ready"))
-        # Send '8's and wait for the 'U' response
-        skip_write = False
-        while True:
-            if not skip_write:
-                ser.flushInput()
-                ser.write(b'8')
-            skip_write = False
-
-            c = ser.read()
-            if c == b'U':
-                break
-
-            if len(c) > 0:
-                skip_write = True
-
-            if not progress_func():
-                return False
-
-        progress_func(msg=_("Waiting acknowledgement"))
-        ser.flushInput()
-        ser.write(data)
-        for i in range(10):
-            c = ser.read()
-            if c == b'U':
-                return True
-
-            if len(c) > 0:
-                raise Exception(_("Invalid reply byte '%(chr)02x'") % {"chr": ord(c)})
-
-            if not progress_func():
-                break
-
-        return False
+        return transport.RunSync(transport.Upload_EB2xx(
+            self, com_port, progress_func, transport.OpenBlocking))
 
 def DetectFormat2(l):
     if len(l) < 22:
@@ -696,4 +656,4 @@ def DetectFormat2(l):
     return False
 
 infineon.RegisterFamily(_("EB2xx (Infineon 2)"), Profile, DetectFormat2, 0,
-                        ControllerModelDesc)
+                        ControllerModelDesc, ControllerParameters, (22, 0, "EB2"))
@@ -6,7 +6,7 @@
 import serial
 import time
 import locale
-from xpdm import infineon
+from xpdm import infineon, transport
 
 # -- # Constants # -- #
 
@@ -45,6 +45,11 @@ EBS_STRONG = 2
 EBSLevelDesc = [_("Disabled"), _("Moderate"), _("Strong"), _("Unlimited")]
 EBSLevel2Raw = [0, 4, 8, 255]
 
+def EBSLevelFromRaw(prof, v):
+    if v not in EBSLevel2Raw:
+        raise ValueError(_("Unknown EBS level %(val)d in raw data") % {"val": v})
+    return EBSLevel2Raw.index(v)
+
 # Guard mode signal polarity (anti-theft)
 GP_LOW = 0
 GP_HIGH = 1
@@ -194,8 +199,7 @@ This parameter mostly affects the acceleration on low speeds.\
         "Units": _("A"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2PhaseCurrent"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["PhaseCurrent2Raw"](v)),
+        "Conversion": "PhaseCurrent",
     },
     "BatteryCurrent": {
         "Type": "f",
@@ -210,8 +214,7 @@ energy heating up the battery (and may blow it, too).\
         "Units": _("A"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2BattCurrent"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["BattCurrent2Raw"](v)),
+        "Conversion": "BattCurrent",
     },
     "LowVoltage": {
         "Type": "f",
@@ -229,8 +232,7 @@ the health of your battery.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "LowVoltageTolerance": {
         "Type": "f",
@@ -246,8 +248,7 @@ after a bit of rest.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "SpeedSwitchMode": {
         "Type": "i",
@@ -449,6 +450,7 @@ the more effective is braking.\
         "GetDisplay": lambda prof, v: EBSLevelDesc[v],
         # This member, if defined, tells how to translate setting to raw value
         "ToRaw": lambda prof, v: EBSLevel2Raw[v],
+        "FromRaw": EBSLevelFromRaw,
     },
     "EBSLimVoltage": {
         "Type": "f",
@@ -465,8 +467,7 @@ to prevent blowing out the controller MOSFETs.\
         "Units": _("V"),
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "GuardLevel": {
         "Type": "i",
@@ -519,6 +520,7 @@ to pedalling.\
         "Range": (2, 255),
         "Precision": 0,
         "ToRaw": lambda prof, v: v - 2,
+        "FromRaw": lambda prof, v: v + 2,
         "SetDisplay": lambda prof, v: v,
         "GetDisplay": lambda prof, v: v,
     },
@@ -637,12 +639,17 @@ class Profile(infineon.Profile):
         0,
     ]
 
+    OpenSerial = infineon.Profile.OpenSerial_EB3xx_KH6xx
+    Upload = infineon.Profile.Upload_EB3xx_KH6xx
+    Download = infineon.Profile.Download_EB3xx_KH6xx
+    UploadAsync = transport.Upload_EB3xx_KH6xx
+    DownloadAsync = transport.Download_EB3xx_KH6xx
+    UploadVerify = infineon.Profile.UploadVerify_EB3xx_KH6xx
+    UploadVerifyAsync = transport.UploadVerify_EB3xx_KH6xx
+
     def __init__(self, Family, FileName):
         infineon.Profile.__init__(self, Family, FileName,
                                   ControllerModelDesc, ControllerParameters)
-        self.OpenSerial = self.OpenSerial_EB3xx_KH6xx
-        self.Upload = self.Upload_EB3xx_KH6xx
-        self.Download = self.Download_EB3xx_KH6xx
 
 def DetectFormat3(l):
     if len(l) < 26:
@@ -657,4 +664,4 @@ def DetectFormat3(l):
     return False
 
 infineon.RegisterFamily(_("EB3xx (Infineon 3)"), Profile, DetectFormat3, infineon.CAP_DOWNLOAD,
-                        ControllerModelDesc)
+                        ControllerModelDesc, ControllerParameters, (26, 0, "EB3"))
@@ -6,7 +6,7 @@
 import serial
 import time
 import locale
-from xpdm import infineon
+from xpdm import infineon, transport
 
 # -- # Constants # -- #
 
@@ -172,8 +172,7 @@ This parameter mostly affects the acceleration on low speeds.\
         "Units": "A",
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2PhaseCurrent"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["PhaseCurrent2Raw"](v)),
+        "Conversion": "PhaseCurrent",
     },
     "BatteryCurrent": {
         "Type": "f",
@@ -188,8 +187,7 @@ energy heating up the battery (and may blow it, too).\
         "Units": "A",
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2BattCurrent"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["BattCurrent2Raw"](v)),
+        "Conversion": "BattCurrent",
     },
     "CurrentCompensation": {
         "Type": "i",
@@ -219,8 +217,7 @@ of the default.\
         "Units": "V",
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "LowVoltageTolerance": {
         "Type": "f",
@@ -236,8 +233,7 @@ after a bit of rest.\
         "Units": "V",
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "LowVoltageHalt": {
         "Type": "i",
@@ -667,8 +663,7 @@ to prevent blowing out the controller MOSFETs.\
         "Units": "V",
         "Widget": infineon.PWT_SPINBUTTON,
         "Range": (1, 255),
-        "GetDisplay": lambda prof, v: prof.GetController()["Raw2Voltage"](v),
-        "SetDisplay": lambda prof, v: round(prof.GetController()["Voltage2Raw"](v)),
+        "Conversion": "Voltage",
     },
     "GuardLevel": {
         "Type": "i",
@@ -999,12 +994,17 @@ class Profile(infineon.Profile):
         0
     ]
 
+    OpenSerial = infineon.Profile.OpenSerial_EB3xx_KH6xx
+    Upload = infineon.Profile.Upload_EB3xx_KH6xx
+    Download = infineon.Profile.Download_EB3xx_KH6xx
+    UploadAsync = transport.Upload_EB3xx_KH6xx
+    DownloadAsync = transport.Download_EB3xx_KH6xx
+    UploadVerify = infineon.Profile.UploadVerify_EB3xx_KH6xx
+    UploadVerifyAsync = transport.UploadVerify_EB3xx_KH6xx
+
     def __init__(self, Family, FileName):
         infineon.Profile.__init__(self, Family, FileName,
                                   ControllerModelDesc, ControllerParameters)
-        self.OpenSerial = self.OpenSerial_EB3xx_KH6xx
-        self.Upload = self.Upload_EB3xx_KH6xx
-        self.Download = self.Download_EB3xx_KH6xx
 
 
 def DetectFormat4(l):
@@ -1021,4 +1021,4 @@ def DetectFormat4(l):
 
 
 infineon.RegisterFamily("KH6xx (Infineon 4)", Profile, DetectFormat4, infineon.CAP_DOWNLOAD,
-                        ControllerModelDesc)
+                        ControllerModelDesc, ControllerParameters, (48, 23, "KH6"))
@@ -5,7 +5,7 @@
 import serial
 import time
 import locale
-from xpdm import infineon
+from xpdm import infineon, transport
 
 # Define constants and mappings specific to KT controllers
 
@@ -36,6 +36,28 @@ KT_ControllerParameters = {
         "GetDisplay": lambda prof, v: KT_ControllerModelDesc[v - 1]["Name"],
         "ToRaw": lambda prof, v: KT_ControllerModelDesc[v - 1]["ControllerModel"],
     },
+    "PhaseCurrent": {
+        "Type": "f",
+        "Name": _("Phase current limit"),
+        "Description": _("The current limit in motor phase wires."),
+        "Default": 30,
+        "Depends": ["ControllerModel"],
+        "Units": _("A"),
+        "Widget": infineon.PWT_SPINBUTTON,
+        "Range": (1, 255),
+        "Conversion": "PhaseCurrent",
+    },
+    "BatteryCurrent": {
+        "Type": "f",
+        "Name": _("Battery current limit"),
+        "Description": _("The limit for the current drawn out of the battery."),
+        "Default": 14,
+        "Depends": ["ControllerModel"],
+        "Units": _("A"),
+        "Widget": infineon.PWT_SPINBUTTON,
+        "Range": (1, 255),
+        "Conversion": "BattCurrent",
+    },
     # Define other parameters similarly
 }
 
@@ -63,11 +85,16 @@ class KT_Profile(infineon.Profile):
         # Add more parameters as necessary
     ]
 
+    OpenSerial = infineon.Profile.OpenSerial_EB3xx_KH6xx
+    Upload = infineon.Profile.Upload_EB3xx_KH6xx
+    Download = infineon.Profile.Download_EB3xx_KH6xx
+    UploadAsync = transport.Upload_EB3xx_KH6xx
+    DownloadAsync = transport.Download_EB3xx_KH6xx
+    UploadVerify = infineon.Profile.UploadVerify_EB3xx_KH6xx
+    UploadVerifyAsync = transport.UploadVerify_EB3xx_KH6xx
+
     def __init__(self, Family, FileName):
         infineon.Profile.__init__(self, Family, FileName, KT_ControllerModelDesc, KT_ControllerParameters)
-        self.OpenSerial = self.OpenSerial_EB3xx_KH6xx
-        self.Upload = self.Upload_EB3xx_KH6xx
-        self.Download = self.Download_EB3xx_KH6xx
 
 def KT_DetectFormat(l):
     if len(l) < 10:
@@ -75,4 +102,4 @@ def KT_DetectFormat(l):
     # Implement detection logic based on KT controller specifics
     return True
 
-infineon.RegisterFamily(_("KT Controllers"), KT_Profile, KT_DetectFormat, infineon.CAP_DOWNLOAD, KT_ControllerModelDesc)
+infineon.RegisterFamily(_("KT Controllers"), KT_Profile, KT_DetectFormat, infineon.CAP_DOWNLOAD, KT_ControllerModelDesc, KT_ControllerParameters, (10, None, None))
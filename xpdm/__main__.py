@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+# Allows running the command line interface as "python -m xpdm"
+#
+
+import sys
+from xpdm.cli import main
+
+sys.exit(main())
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Columnar storage and vectorized raw image encoding for many profiles
+# of the same controller family (requires NumPy)
+#
+
+import numpy
+from xpdm import infineon
+
+
+def Scalar(x):
+    """Convert a column element back to a Python int or float"""
+    x = x.item()
+    if x == int(x):
+        return int(x)
+    return x
+
+
+class Column(numpy.ndarray):
+    """A column slice which also supports the round() builtin, so that
+    the linear conversion lambdas from the parameter descriptions can be
+    applied to it as a whole.
+    """
+    def __round__(self, ndigits=None):
+        if ndigits is None:
+            return numpy.rint(self)
+        return numpy.round(self, ndigits)
+
+
+class ModelProxy:
+    """A stand-in profile passed to parameter converters while encoding
+    all the batch rows which use the same controller model.
+    """
+    GetController = infineon.Profile.GetController
+    GetModel = infineon.Profile.GetModel
+
+    def __init__(self, ControllerModelDesc, ControllerModel):
+        self.ControllerModelDesc = ControllerModelDesc
+        self.ControllerModel = ControllerModel
+
+
+class ProfileBatch:
+    """N profiles of one controller family, stored as a NumPy column
+    per controller parameter. BitField members are not stored separately,
+    reading or writing them works on the bits of their storage column.
+    """
+
+    def __init__(self, Family, Count):
+        self.Family = Family
+        self.Count = Count
+
+        self.Columns = {}
+        for parm, desc in Family.Parameters.items():
+            if "BitField" not in desc:
+                self.Columns[parm] = numpy.full(Count, desc.get("Default", 0),
+                                                dtype=numpy.float64)
+
+        for parm, desc in Family.Parameters.items():
+            if ("BitField" in desc) and ("Default" in desc):
+                self[parm] = desc["Default"]
+
+    @classmethod
+    def FromProfiles(cls, Family, Profiles):
+        batch = cls(Family, len(Profiles))
+        for parm, col in batch.Columns.items():
+            col[:] = [getattr(prof, parm) for prof in Profiles]
+        return batch
+
+    def __len__(self):
+        return self.Count
+
+    def __getitem__(self, parm):
+        desc = self.Family.Parameters[parm]
+        if "BitField" in desc:
+            col = self.Columns[desc["BitField"]].astype(numpy.int64)
+            return (col & desc["BitMask"]) >> desc["BitShift"]
+
+        return self.Columns[parm]
+
+    def __setitem__(self, parm, val):
+        desc = self.Family.Parameters[parm]
+        if "BitField" in desc:
+            col = self.Columns[desc["BitField"]]
+            val = numpy.asarray(val, dtype=numpy.int64)
+            col[:] = (col.astype(numpy.int64) & ~desc["BitMask"]) | \
+                ((val << desc["BitShift"]) & desc["BitMask"])
+            return
+
+        self.Columns[parm][:] = val
+
+    def GetProfile(self, n, FileName):
+        """Create a standalone profile from the n-th row of the batch"""
+        prof = self.Family.CreateProfile(FileName)
+        for parm, col in self.Columns.items():
+            setattr(prof, parm, Scalar(col[n]))
+        return prof
+
+    def Convert(self, enc, proxy, val):
+        """Apply a scalar-style converter to a column slice"""
+        try:
+            res = numpy.broadcast_to(numpy.asarray(enc(proxy, val.view(Column)),
+                                                   dtype=numpy.float64), val.shape)
+        except (TypeError, ValueError, IndexError, KeyError):
+            # Table lookups and bit tests don't work on arrays; these
+            # converters only see a handful of distinct values, though
+            keys, inv = numpy.unique(val, return_inverse=True)
+            res = numpy.array([enc(proxy, Scalar(k)) for k in keys],
+                              dtype=numpy.float64)[inv]
+        return res
+
+    def BuildRaw(self):
+        """Return a (N x image length) uint8 matrix of raw images, the
+        last column holding the XOR checksum of every row.
+        """
+        codec = self.Family.Codec
+        data = numpy.empty((self.Count, codec.Length), dtype=numpy.uint8)
+        data[:] = numpy.frombuffer(codec.Template, dtype=numpy.uint8)
+
+        models = self.Columns["ControllerModel"].astype(numpy.int64)
+        groups = []
+        for model in numpy.unique(models):
+            model = model.item()
+            groups.append((ModelProxy(self.Family.ModelDesc, model),
+                           numpy.nonzero(models == model)[0]))
+            b23 = codec.Byte23[model - 1]
+            if b23 is not None:
+                data[models == model, 23] = b23
+
+        # Only parameters depending on the controller model need to be
+        # converted separately for every model present in the batch
+        everyone = [(ModelProxy(self.Family.ModelDesc, 1), slice(None))]
+        for idx, parm, enc, conv in codec.Encoders:
+            if (conv is not None) or \
+               (parm in self.Family.Dependents.get("ControllerModel", ())):
+                parts = groups
+            else:
+                parts = everyone
+
+            for proxy, rows in parts:
+                val = self.Columns[parm][rows]
+                if conv is None:
+                    raw = numpy.trunc(self.Convert(enc, proxy, val))
+                else:
+                    table = proxy.GetController()["Tables"][conv]
+                    raw = numpy.asarray(table.Raws)[
+                        numpy.searchsorted(table.Keys, val, side="right")]
+                if not numpy.all((raw >= 0) & (raw <= 255)):
+                    raise ValueError(_("Parameter %(parm)s is out of range for model %(model)s") %
+                                     {"parm": parm, "model": proxy.GetModel()})
+                data[rows, idx] = raw
+
+        data[:, -1] = numpy.bitwise_xor.reduce(data[:, :-1], axis=1)
+        return data
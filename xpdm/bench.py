@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+# Benchmarks: upload and download sessions against the controller
+# emulator, with session latency, throughput and CPU time; raw image
+# encoding and decoding; profile list refresh
+#
+
+import os
+import time
+import json
+import asyncio
+import platform
+import tempfile
+from xpdm import VERSION, infineon, handshake, serialpool
+
+# Bump this when the results file layout changes
+BENCH_VERSION = 1
+
+# Families to benchmark: family name prefix, baud rate, bits per character
+BenchFamilies = [
+    ("EB2", 9600, 10),
+    ("EB3", 38400, 11),
+    ("KH6", 38400, 11),
+]
+
+# Session kinds: name, needs CAP_DOWNLOAD, async
+BenchOps = [
+    ("upload", False, False),
+    ("upload-async", False, True),
+    ("download", True, False),
+    ("download-async", True, True),
+]
+
+
+def NoProgress(pos=None, msg=None):
+    return True
+
+
+def Session(prof, op, port, is_async):
+    if op.startswith("upload"):
+        if is_async:
+            return asyncio.run(prof.UploadAsync(port, NoProgress))
+        return prof.Upload(port, NoProgress)
+    if is_async:
+        return asyncio.run(prof.DownloadAsync(port, NoProgress, None))
+    return prof.Download(port, NoProgress, None)
+
+
+def RunOp(fam, baud, bits, op, is_async, sessions, latency, jitter, seed):
+    """Run a number of sessions of one kind, return the result dict.
+    Only the sessions which succeeded are timed and counted.
+    """
+    # pty is not available everywhere, so import it only when needed
+    from xpdm import emulator
+
+    prof = fam.CreateProfile("bench")
+    times = []
+    cpu = []
+    failures = 0
+    nbytes = 0
+    with emulator.Emulator(fam, Latency=latency, Jitter=jitter, Seed=seed,
+                           Baud=baud, BitsPerByte=bits) as emu:
+        for i in range(sessions):
+            counters = dict(serialpool.Pool.Counters)
+            start = time.perf_counter()
+            cpu_start = time.thread_time()
+            try:
+                ok = Session(prof, op, emu.Port, is_async)
+            except Exception:
+                ok = False
+            cpu_end = time.thread_time()
+            end = time.perf_counter()
+            if not ok:
+                failures += 1
+                continue
+            cpu.append(cpu_end - cpu_start)
+            times.append(end - start)
+            nbytes += (serialpool.Pool.Counters["bytes_in"] - counters["bytes_in"] +
+                       serialpool.Pool.Counters["bytes_out"] - counters["bytes_out"])
+        # Don't keep the emulator port in the pool
+        serialpool.Pool.Close(emu.Port)
+
+    total = sum(times)
+    return {
+        "family": fam.Family,
+        "op": op,
+        "baud": baud,
+        "sessions": sessions,
+        "failures": failures,
+        "p50": handshake.Percentile(times, 50),
+        "p95": handshake.Percentile(times, 95),
+        "p99": handshake.Percentile(times, 99),
+        "bytes_per_s": nbytes / total if total > 0 else 0.0,
+        "cpu": sum(cpu) / len(cpu) if cpu else None,
+    }
+
+
+def Run(families=None, sessions=20, latency=0.0, jitter=0.0, seed=1, report=None):
+    """Benchmark the given families (names or prefixes, all of
+    BenchFamilies by default); report(result) is called after every kind
+    of session. Returns the results document.
+    """
+    wanted = None
+    if families:
+        wanted = [infineon.FindFamily(f) for f in families]
+    results = []
+    for prefix, baud, bits in BenchFamilies:
+        fam = infineon.FindFamily(prefix)
+        if (fam is None) or ((wanted is not None) and (fam not in wanted)):
+            continue
+        for op, download, is_async in BenchOps:
+            if download and not (fam.Capabilities & infineon.CAP_DOWNLOAD):
+                continue
+            res = RunOp(fam, baud, bits, op, is_async, sessions, latency, jitter, seed)
+            results.append(res)
+            if report is not None:
+                report(res)
+
+    return Document({"sessions": sessions, "latency": latency, "jitter": jitter,
+                      "seed": seed}, results)
+
+
+def Document(config, results):
+    """Return a results document with a description of the system"""
+    return {
+        "version": BENCH_VERSION,
+        "xpd": VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": config,
+        "results": results,
+    }
+
+
+def OldBuildRaw(prof):
+    """The per-field loop which encoded a profile before RawCodec"""
+    data = bytearray()
+
+    for x in prof.ParamRawOrder:
+        if type(x) == str:
+            if "ToRaw" in prof.ControllerParameters[x]:
+                x = prof.ControllerParameters[x]["ToRaw"](prof, getattr(prof, x))
+            elif prof.ControllerParameters[x]["Widget"] == infineon.PWT_COMBOBOX:
+                x = round(getattr(prof, x))
+            elif prof.ControllerParameters[x]["Widget"] == infineon.PWT_SPINBUTTON:
+                x = prof.ControllerParameters[x]["SetDisplay"](prof, getattr(prof, x))
+
+        data.append(int(x))
+
+    if "Byte23" in prof.ControllerModelDesc[prof.ControllerModel - 1]:
+        data[23] = prof.ControllerModelDesc[prof.ControllerModel - 1]["Byte23"]
+
+    crc = 0
+    for x in data:
+        crc = crc ^ x
+    data.append(crc)
+
+    return data
+
+
+def OldLoadRaw(prof, data, name_wildcard):
+    """The per-field loop which decoded a raw image before RawCodec"""
+    data_len = len(prof.ParamRawOrder) + 1
+    if len(data) > data_len:
+        del data[data_len:]
+
+    crc = 0
+    for x in data:
+        crc = crc ^ x
+    if crc != 0:
+        raise ValueError(_("Broken data received (wrong family?)"))
+
+    x = data[prof.ParamRawOrder.index("ControllerModel")]
+    for n in range(len(prof.ControllerModelDesc)):
+        y = prof.ControllerModelDesc[n]
+        if (y["ControllerModel"] == x) and (name_wildcard is None):
+            setattr(prof, "ControllerModel", n + 1)
+            break
+
+    idx = 0
+    for x in prof.ParamRawOrder:
+        if (type(x) == str) and (x != "ControllerModel"):
+            p = data[idx]
+            if "FromRaw" in prof.ControllerParameters[x]:
+                p = prof.ControllerParameters[x]["FromRaw"](prof, p)
+            elif prof.ControllerParameters[x]["Widget"] == infineon.PWT_SPINBUTTON:
+                p = prof.ControllerParameters[x]["GetDisplay"](prof, p)
+            setattr(prof, x, p)
+
+        idx += 1
+
+    return True
+
+
+def TimeCalls(func, calls, rounds=5):
+    """Return the time per call of func(), the best of several rounds"""
+    n = max(1, calls // rounds)
+    best = None
+    for r in range(rounds):
+        start = time.perf_counter()
+        for i in range(n):
+            func()
+        t = (time.perf_counter() - start) / n
+        if (best is None) or (t < best):
+            best = t
+    return best
+
+
+def RunCodec(families=None, calls=20000, report=None):
+    """Time RawCodec encoding and decoding against the per-field loops it
+    replaced, for the given families (all registered ones by default);
+    report(result) is called after every family and operation. Returns
+    the results document.
+    """
+    wanted = None
+    if families:
+        wanted = [infineon.FindFamily(f) for f in families]
+    results = []
+    for fam in infineon.Families:
+        if (wanted is not None) and (fam not in wanted):
+            continue
+        prof = fam.CreateProfile("bench")
+        data = bytes(prof.BuildRaw())
+        # Both ways must give the same results for the timings to mean anything
+        if bytes(OldBuildRaw(prof)) != data:
+            raise ValueError("%s: RawCodec and the old loop encode differently" % fam.Family)
+
+        buf = bytearray(prof.Codec.Length)
+        ops = [("encode", lambda: prof.Codec.Encode(prof, buf), lambda: OldBuildRaw(prof))]
+        # Images without the controller model can't be decoded
+        if prof.Codec.ModelOffset is not None:
+            other = fam.CreateProfile("bench")
+            OldLoadRaw(other, bytearray(data), None)
+            if bytes(other.BuildRaw()) != data:
+                raise ValueError("%s: RawCodec and the old loop decode differently" % fam.Family)
+            ops.append(("decode", lambda: prof.LoadRaw(bytearray(data), None),
+                        lambda: OldLoadRaw(prof, bytearray(data), None)))
+
+        for op, new, old in ops:
+            res = {
+                "family": fam.Family,
+                "op": op,
+                "calls": calls,
+                "time": TimeCalls(new, calls),
+                "old_time": TimeCalls(old, calls),
+            }
+            results.append(res)
+            if report is not None:
+                report(res)
+
+    return Document({"calls": calls}, results)
+
+
+def Load(fn):
+    with open(fn, "r", encoding="utf-8") as f:
+        doc = json.load(f)
+    if doc.get("version") != BENCH_VERSION:
+        raise ValueError(_("Unsupported benchmark results file: %(fn)s") % {"fn": fn})
+    return doc
+
+
+def Save(doc, fn):
+    with open(fn, "w", encoding="utf-8") as f:
+        json.dump(doc, f, indent=1)
+
+
+def Format(res, old=None):
+    """Return a report line for a result, compared with an older one"""
+    if res["p50"] is None:
+        line = "%-20s %-15s %s" % (res["family"], res["op"], _("no session succeeded"))
+    else:
+        line = "%-20s %-15s %8.1f %8.1f %8.1f ms %8.0f B/s %7.2f ms CPU" % (
+            res["family"], res["op"], res["p50"] * 1000, res["p95"] * 1000, res["p99"] * 1000,
+            res["bytes_per_s"], res["cpu"] * 1000)
+    if res["failures"]:
+        line += _(", %(n)d of %(total)d FAILED") % {"n": res["failures"], "total": res["sessions"]}
+    if old is not None:
+        if old["p50"] and res["p50"] is not None:
+            line += " (p50 %+.1f%%)" % ((res["p50"] / old["p50"] - 1) * 100)
+        if res["failures"] != old["failures"]:
+            line += _(" (failures %(old)d -> %(new)d)") % {"old": old["failures"],
+                                                          "new": res["failures"]}
+    return line
+
+
+def RunLibrary(count=10000, report=None):
+    """Time refreshing a list of count profiles: parsing every file as
+    the profile list did before the index, building the index, loading
+    it at startup, and refreshing with an up to date index and with one
+    file changed;
+    report(result) is called after every step. Returns the results
+    document.
+    """
+    from xpdm import library
+
+    results = []
+    name = _("%(n)d profiles") % {"n": count}
+
+    def Step(op, func):
+        start = time.perf_counter()
+        func()
+        res = {"family": name, "op": op, "time": time.perf_counter() - start}
+        results.append(res)
+        if report is not None:
+            report(res)
+
+    with tempfile.TemporaryDirectory(prefix="xpd-bench-") as tmp:
+        # The default profile of every family, in turns
+        contents = []
+        for fam in infineon.Families:
+            fn = os.path.join(tmp, "default.asv")
+            fam.CreateProfile(fn).Save()
+            with open(fn, "rb") as f:
+                contents.append(f.read())
+            os.remove(fn)
+        files = []
+        for i in range(count):
+            fn = os.path.join(tmp, "profile%05d.asv" % i)
+            with open(fn, "wb") as f:
+                f.write(contents[i % len(contents)])
+            files.append(fn)
+
+        idx = os.path.join(tmp, "profiles.json")
+
+        def Scan(index):
+            rows, errors = index.Scan([tmp])
+            if errors or len(rows) != count:
+                raise ValueError("Scanned %d of %d profiles" % (len(rows), count))
+            index.Save()
+
+        Step("parse-all", lambda: [library.LoadProfile(fn) for fn in files])
+        Step("first-scan", lambda: Scan(library.ProfileIndex(idx)))
+        # Starting up loads the index from disk, a refresh has it in memory
+        Step("startup", lambda: Scan(library.ProfileIndex(idx)))
+        index = library.ProfileIndex(idx)
+        Step("warm-scan", lambda: Scan(index))
+        st = os.stat(files[0])
+        os.utime(files[0], ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+        Step("one-changed", lambda: Scan(index))
+
+    return Document({"profiles": count}, results)
+
+
+def FormatLibrary(res, old=None):
+    """Return a report line for a library result, compared with an older one"""
+    line = "%-20s %-15s %8.1f ms" % (res["family"], res["op"], res["time"] * 1000)
+    if (old is not None) and old.get("time"):
+        line += " (%+.1f%%)" % ((res["time"] / old["time"] - 1) * 100)
+    return line
+
+
+def FormatCodec(res, old=None):
+    """Return a report line for a codec result, compared with an older one"""
+    line = "%-20s %-15s %8.2f us %8.2f us  x%.2f" % (
+        res["family"], res["op"], res["time"] * 1e6, res["old_time"] * 1e6,
+        res["old_time"] / res["time"])
+    if (old is not None) and old.get("time"):
+        line += " (%+.1f%%)" % ((res["time"] / old["time"] - 1) * 100)
+    return line
+
+
+def Failures(doc):
+    """Return the number of failed sessions in a results document"""
+    return sum(r.get("failures", 0) for r in doc["results"])
+
+
+def Index(doc):
+    """Return the results of a document by (family, session kind)"""
+    return dict(((r["family"], r["op"]), r) for r in doc["results"])
@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+# Command line interface for XPD, works without GTK
+#
+
+import os
+import sys
+import gettext
+import argparse
+from xpdm import VERSION, comports
+from xpdm import infineon, progress
+
+# The other modules are imported by the commands which use them, so that
+# the command line starts quickly
+
+
+def SetupGettext():
+    # Find the language translation files
+    localedir = None
+    if not gettext.find("xpd"):
+        localedir = os.path.join(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))), "locale")
+    gettext.install("xpd", localedir)
+
+
+class Progress(progress.Throttle):
+    """A progress_func for profile upload/download which reports to stderr
+    and gives up after a timeout (in seconds, None waits forever)
+    """
+
+    def __init__(self, timeout, quiet):
+        progress.Throttle.__init__(self, Timeout=timeout)
+        self.Quiet = quiet
+        self.TTY = sys.stderr.isatty()
+
+    def Show(self, pos, msg):
+        if not self.Quiet:
+            if msg is not None:
+                sys.stderr.write("%s\n" % msg)
+            if (pos is not None) and self.TTY:
+                sys.stderr.write("%3d%%\r" % min(100, int(pos * 100)))
+            sys.stderr.flush()
+        return True
+
+
+def GetFamily(name):
+    fam = infineon.FindFamily(name)
+    if fam is None:
+        raise SystemExit(_("Unknown controller family '%(name)s', known families are: %(list)s") %
+                         {"name": name, "list": ", ".join(x.Family for x in infineon.Families)})
+    return fam
+
+
+def GetPort(port):
+    if port:
+        return port
+    ports = sorted(comports())
+    if not ports:
+        raise SystemExit(_("No serial ports found, please use --port"))
+    return ports[0][1]
+
+
+def LoadProfile(fn):
+    from xpdm import library
+
+    prof = library.LoadProfile(fn)
+    if prof is None:
+        raise SystemExit(_("Unknown profile format: %(fn)s") % {"fn": fn})
+    return prof
+
+
+def WriteRaw(fn, data):
+    if fn is None or fn == "-":
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    else:
+        with open(fn, "wb") as f:
+            f.write(data)
+
+
+def cmd_encode(args):
+    prof = LoadProfile(args.profile)
+    WriteRaw(args.output, prof.BuildRaw())
+
+
+def cmd_decode(args):
+    fam = GetFamily(args.family)
+    if args.image == "-":
+        data = bytearray(sys.stdin.buffer.read())
+    else:
+        with open(args.image, "rb") as f:
+            data = bytearray(f.read())
+
+    prof = fam.CreateProfile(args.output)
+    if not prof.LoadRaw(data, args.model):
+        raise SystemExit(_("Controller model not found in raw data"))
+    prof.Save()
+
+
+def cmd_convert(args):
+    prof = LoadProfile(args.profile)
+    fam = GetFamily(args.family)
+    newprof = fam.CreateProfile(args.output)
+    newprof.CopyParameters(prof)
+    newprof.Save()
+
+
+def cmd_upload(args):
+    import asyncio
+    from xpdm import trace
+
+    prof = LoadProfile(args.profile)
+    port = GetPort(args.port)
+    prog = Progress(args.timeout, args.quiet)
+
+    if not args.quiet:
+        sys.stderr.write(_("Applying profile %(prof)s (%(ctrl)s) via %(port)s\n") %
+                         {"prof": prof.Description, "ctrl": prof.GetModel(), "port": port})
+    upload = prof.UploadAsync
+    if args.verify:
+        if not prof.CanVerify():
+            raise SystemExit(_("Family %(family)s does not support reading") %
+                             {"family": prof.Family})
+        upload = prof.UploadVerifyAsync
+
+    writer = None
+    if args.trace:
+        writer = trace.Record(prof, args.trace)
+    try:
+        ok = asyncio.run(upload(port, prog))
+    except infineon.VerifyError as e:
+        for parm, up, back in e.Mismatches:
+            sys.stderr.write(_("%(parm)s: uploaded %(up)s, read back %(back)s") %
+                             {"parm": parm, "up": up, "back": back} + "\n")
+        raise
+    finally:
+        if writer is not None:
+            writer.Close()
+    if not ok:
+        raise SystemExit(_("Upload timed out"))
+    if not args.quiet:
+        if args.verify:
+            sys.stderr.write(_("Settings uploaded and verified successfully") + "\n")
+        else:
+            sys.stderr.write(_("Settings uploaded successfully") + "\n")
+
+
+def cmd_download(args):
+    import asyncio
+    from xpdm import trace
+
+    fam = GetFamily(args.family)
+    if not (fam.Capabilities & infineon.CAP_DOWNLOAD):
+        raise SystemExit(_("Family %(family)s does not support reading") % {"family": fam.Family})
+    port = GetPort(args.port)
+    prog = Progress(args.timeout, args.quiet)
+
+    prof = fam.CreateProfile(args.output)
+    writer = None
+    if args.trace:
+        writer = trace.Record(prof, args.trace)
+    try:
+        ok = asyncio.run(prof.DownloadAsync(port, prog, args.model))
+    finally:
+        if writer is not None:
+            writer.Close()
+    if not ok:
+        if prog.TimedOut:
+            raise SystemExit(_("Download timed out"))
+        raise SystemExit(_("Controller model not found in raw data"))
+    prof.Save()
+    if not args.quiet:
+        sys.stderr.write(_("Settings downloaded successfully") + "\n")
+
+
+def cmd_station(args):
+    import threading
+    from xpdm import transport, station, handshake, serialpool
+
+    if args.port:
+        ports = args.port
+    else:
+        ports = [port for order, port, desc, hwid in sorted(comports())]
+        if not ports:
+            raise SystemExit(_("No serial ports found, please use --port"))
+
+    profs = [LoadProfile(fn) for fn in args.profile]
+    if len(profs) == 1:
+        profs = profs * len(ports)
+    elif len(profs) != len(ports):
+        raise SystemExit(_("Give either one profile, or one profile per port"))
+
+    def Changed(job):
+        if job.Message and not args.quiet:
+            sys.stderr.write("%s: %s\n" % (job.Port, job.Message))
+
+    stopped = threading.Event()
+    loop = transport.SessionLoop()
+    st = station.Station([station.PortJob(port, prof) for port, prof in zip(ports, profs)],
+                         loop, Changed, stopped.set, args.repeat, args.verify)
+    st.Start()
+    try:
+        # wait() with a timeout so that Ctrl+C gets through
+        while not stopped.wait(0.5):
+            pass
+    except KeyboardInterrupt:
+        st.Stop()
+        stopped.wait()
+    loop.Close()
+
+    for job in st.Jobs:
+        print(_("%(port)s: %(done)d programmed, %(failed)d failed") %
+              {"port": job.Port, "done": job.Done, "failed": job.Failed})
+        stats = handshake.Stats.Summary(job.Profile.Family, job.Port)
+        if stats is not None:
+            print(_("    %(count)d handshakes, median time to ready %(ready).2f s, "
+                    "reply latency %(latency).3f s") %
+                  {"count": stats[0], "ready": stats[1], "latency": stats[2]})
+    done, failed = st.Totals()
+    print(_("Total: %(done)d programmed, %(failed)d failed in %(time).0f s, %(rate).1f controllers/hour") %
+          {"done": done, "failed": failed, "time": st.Elapsed(), "rate": st.Throughput()})
+    cnt = serialpool.Pool.Counters
+    print(_("Serial ports: %(opened)d opened, %(reused)d reused, "
+            "%(bytes_in)d bytes received, %(bytes_out)d bytes sent") % cnt)
+    if failed:
+        raise SystemExit(1)
+
+
+def cmd_trace(args):
+    from xpdm import trace
+
+    events = trace.Load(args.trace)
+    if args.dump:
+        for t, kind, data in events:
+            print("%10.6f %-7s %s" % (t, trace.EventNames.get(kind, kind), data.hex()))
+
+    res = trace.Summary(events)
+    print(_("%(total).3f s, %(probes)d probes, %(bytes_out)d bytes sent, "
+            "%(bytes_in)d bytes received") % res)
+    for name, desc in (("handshake", _("handshake")), ("transfer", _("transfer")),
+                       ("ack", _("acknowledgement wait"))):
+        if res[name] is not None:
+            print("    %s: %.3f s" % (desc, res[name]))
+
+
+def cmd_replay(args):
+    from xpdm import trace
+
+    if args.profile:
+        prof = LoadProfile(args.profile)
+    elif args.family:
+        prof = GetFamily(args.family).CreateProfile(os.devnull)
+    else:
+        raise SystemExit(_("Give a profile to replay an upload, or --family for a download"))
+
+    rep = trace.Replay(prof, args.trace)
+    prog = Progress(None, True)
+    try:
+        if args.profile:
+            ok = prof.Upload("replay", prog)
+        else:
+            ok = prof.Download("replay", prog, args.model)
+    except Exception as e:
+        print(_("Failed: %(msg)s") % {"msg": e})
+    else:
+        print(_("Finished: %(ok)s") % {"ok": ok})
+    print(_("%(pos)d of %(count)d events replayed, %(mismatch)d writes differ") %
+          {"pos": rep.Pos, "count": len(rep.Events), "mismatch": rep.Mismatches})
+
+
+def cmd_emulate(args):
+    import time
+    # pty is not available everywhere, so import it only when needed
+    from xpdm import emulator
+
+    fam = GetFamily(args.family)
+    image = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image = f.read()
+    emu = emulator.Emulator(fam, image, args.latency, args.loss,
+                            os.urandom(args.garbage), args.ready_delay, Jitter=args.jitter)
+    print(_("Emulating %(family)s on %(port)s, press Ctrl+C to stop") %
+          {"family": fam.Family, "port": emu.Port}, flush=True)
+
+    last = None
+    try:
+        while True:
+            cur = (emu.Uploads, emu.Downloads, emu.Errors)
+            if cur != last:
+                print(_("%(up)d uploads, %(down)d downloads, %(err)d bad frames") %
+                      {"up": cur[0], "down": cur[1], "err": cur[2]}, flush=True)
+                last = cur
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emu.Close()
+        if args.output:
+            WriteRaw(args.output, emu.Image)
+
+
+def cmd_bench(args):
+    # The benchmarks run against the pty emulator
+    from xpdm import bench
+
+    prev = {}
+    if args.compare:
+        prev = bench.Index(bench.Load(args.compare))
+
+    fmt = bench.Format
+    if args.codec:
+        fmt = bench.FormatCodec
+    elif args.library:
+        fmt = bench.FormatLibrary
+
+    def Report(res):
+        print(fmt(res, prev.get((res["family"], res["op"]))), flush=True)
+
+    if args.codec:
+        print(_("%(family)-20s %(op)-15s   RawCodec  old loop") %
+              {"family": _("Family"), "op": _("Operation")})
+        doc = bench.RunCodec(args.family, args.sessions or 20000, report=Report)
+    elif args.library:
+        print(_("%(family)-20s %(op)-15s       time") %
+              {"family": _("Profiles"), "op": _("Refresh")})
+        doc = bench.RunLibrary(args.sessions or 10000, report=Report)
+    else:
+        print(_("%(family)-20s %(op)-15s      p50      p95      p99") %
+              {"family": _("Family"), "op": _("Session")})
+        doc = bench.Run(args.family, args.sessions or 20, args.latency, args.jitter,
+                        report=Report)
+    if args.output:
+        bench.Save(doc, args.output)
+    failed = bench.Failures(doc)
+    if failed:
+        raise SystemExit(_("%(n)d sessions failed") % {"n": failed})
+
+
+def ParseArgs(argv):
+    parser = argparse.ArgumentParser(prog="xpd",
+        description=_("eXtended Parameter Designer command line interface"))
+    parser.add_argument("--version", action="version", version=VERSION)
+    parser.add_argument("--stats", metavar="FILE",
+                        help=_("keep controller handshake statistics in FILE, "
+                               "used to tune the handshake timing"))
+    sub = parser.add_subparsers(dest="command", metavar="COMMAND")
+    sub.required = True
+
+    p = sub.add_parser("encode", help=_("build the raw controller image of a profile"))
+    p.add_argument("profile", help=_("profile (.asv) file"))
+    p.add_argument("-o", "--output", help=_("output file, default is stdout"))
+    p.set_defaults(func=cmd_encode)
+
+    p = sub.add_parser("decode", help=_("create a profile from a raw controller image"))
+    p.add_argument("image", help=_("raw image file, '-' for stdin"))
+    p.add_argument("-f", "--family", required=True, help=_("controller family"))
+    p.add_argument("-m", "--model", help=_("controller model name wildcard"))
+    p.add_argument("-o", "--output", required=True, help=_("profile (.asv) file to create"))
+    p.set_defaults(func=cmd_decode)
+
+    p = sub.add_parser("convert", help=_("convert a profile to another controller family"))
+    p.add_argument("profile", help=_("profile (.asv) file"))
+    p.add_argument("-f", "--family", required=True, help=_("target controller family"))
+    p.add_argument("-o", "--output", required=True, help=_("profile (.asv) file to create"))
+    p.set_defaults(func=cmd_convert)
+
+    for name, func, hlp in (
+            ("upload", cmd_upload, _("upload a profile to the controller")),
+            ("download", cmd_download, _("read a profile from the controller"))):
+        p = sub.add_parser(name, help=hlp)
+        if name == "upload":
+            p.add_argument("profile", help=_("profile (.asv) file"))
+            p.add_argument("-v", "--verify", action="store_true",
+                           help=_("read the settings back and compare them with the profile"))
+        else:
+            p.add_argument("-f", "--family", required=True, help=_("controller family"))
+            p.add_argument("-m", "--model", help=_("controller model name wildcard"))
+            p.add_argument("-o", "--output", required=True, help=_("profile (.asv) file to create"))
+        p.add_argument("-p", "--port", help=_("serial port, default is the first one found"))
+        p.add_argument("-t", "--timeout", type=float,
+                       help=_("give up after this many seconds, default is to wait forever"))
+        p.add_argument("-q", "--quiet", action="store_true", help=_("don't report progress"))
+        p.add_argument("--trace", metavar="FILE",
+                       help=_("record the serial port traffic to FILE"))
+        p.set_defaults(func=func)
+
+    p = sub.add_parser("station", help=_("upload profiles through several ports at once"))
+    p.add_argument("profile", nargs="+",
+                   help=_("profile (.asv) file, or one profile per port"))
+    p.add_argument("-p", "--port", action="append",
+                   help=_("serial port, may be repeated; default is all ports found"))
+    p.add_argument("-r", "--repeat", action="store_true",
+                   help=_("keep programming controllers until interrupted"))
+    p.add_argument("-v", "--verify", action="store_true",
+                   help=_("read the settings back after every upload, where supported"))
+    p.add_argument("-q", "--quiet", action="store_true", help=_("don't report progress"))
+    p.set_defaults(func=cmd_station)
+
+    p = sub.add_parser("trace", help=_("show the phase timings of a serial trace"))
+    p.add_argument("trace", help=_("trace file"))
+    p.add_argument("-d", "--dump", action="store_true", help=_("list all the events"))
+    p.set_defaults(func=cmd_trace)
+
+    p = sub.add_parser("replay", help=_("run an upload or download against a serial trace"))
+    p.add_argument("trace", help=_("trace file"))
+    p.add_argument("profile", nargs="?", help=_("profile (.asv) file to upload"))
+    p.add_argument("-f", "--family", help=_("controller family to download"))
+    p.add_argument("-m", "--model", help=_("controller model name wildcard"))
+    p.set_defaults(func=cmd_replay)
+
+    p = sub.add_parser("bench", help=_("benchmark uploads and downloads against the emulator"))
+    p.add_argument("-f", "--family", action="append",
+                   help=_("controller family, may be repeated; default is EB2xx, EB3xx and KH6xx"))
+    p.add_argument("-n", "--sessions", type=int,
+                   help=_("sessions of every kind to run, default is 20; "
+                          "calls to time with --codec, default is 20000; "
+                          "profiles with --library, default is 10000"))
+    p.add_argument("--latency", type=float, default=0.0,
+                   help=_("controller reply delay, seconds"))
+    p.add_argument("--jitter", type=float, default=0.0,
+                   help=_("random extra reply delay up to this many seconds"))
+    p.add_argument("-o", "--output", help=_("save the results to this JSON file"))
+    p.add_argument("-c", "--compare", metavar="FILE",
+                   help=_("compare with the results saved in FILE"))
+    kind = p.add_mutually_exclusive_group()
+    kind.add_argument("--codec", action="store_true",
+                      help=_("time raw image encoding and decoding instead, "
+                             "against the per-field loops used before"))
+    kind.add_argument("--library", action="store_true",
+                      help=_("time the profile list refresh instead, with and "
+                             "without the profile index"))
+    p.set_defaults(func=cmd_bench)
+
+    p = sub.add_parser("emulate", help=_("emulate a controller on a pseudo-terminal"))
+    p.add_argument("-f", "--family", required=True, help=_("controller family"))
+    p.add_argument("-i", "--image", help=_("raw image to send on download, "
+                                          "default is the family's default settings"))
+    p.add_argument("-o", "--output", help=_("write the last image uploaded to this file on exit"))
+    p.add_argument("--latency", type=float, default=0.0,
+                   help=_("delay before every reply, seconds"))
+    p.add_argument("--jitter", type=float, default=0.0,
+                   help=_("random extra reply delay up to this many seconds"))
+    p.add_argument("--loss", type=float, default=0.0,
+                   help=_("probability of losing every byte, 0 to 1"))
+    p.add_argument("--garbage", type=int, default=0,
+                   help=_("number of random bytes sent on every boot"))
+    p.add_argument("--ready-delay", type=float, default=0.0,
+                   help=_("seconds after boot until the controller answers"))
+    p.set_defaults(func=cmd_emulate)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    SetupGettext()
+    # Load the controller families after gettext, their descriptions are translated
+    from xpdm import EB2xx, EB3xx, KH6xx, serialpool
+
+    args = ParseArgs(argv)
+    if args.stats:
+        from xpdm import handshake
+        handshake.Stats.Load(args.stats)
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        return 130
+    except Exception as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    finally:
+        serialpool.Pool.Close()
+        if args.stats:
+            handshake.Stats.Save(args.stats)
+    return 0
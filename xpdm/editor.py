@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# GTK widgets for editing the parameters of a controller profile
+#
+
+import gtk
+import ctypes
+import math
+from xpdm import infineon
+
+# Alternating parameter row background colors
+ROW_COLORS = [gtk.gdk.Color(1.0, 1.0, 1.0), gtk.gdk.Color(1.0, 0.94, 0.86)]
+
+
+class ParameterEditor:
+    """Builds the parameter editing widgets for a profile and keeps the
+    profile attributes in sync with them. The profile classes themselves
+    know nothing about GTK, so that they can be used without a display.
+    """
+
+    def __init__(self):
+        self.Profile = None
+        self.EditWidgets = {}
+        # Titles of the groups the user keeps expanded
+        self.Expanded = None
+        # Editors built so far by family name: (top widget, EditWidgets)
+        self.Pages = {}
+        # Set while showing the values of another profile in the widgets
+        self.Binding = False
+
+    def FillParameters(self, prof, vbox):
+        """Put the editing widgets for a profile in vbox. The editor of a
+        family is built once and then kept, editing another profile of the
+        same family just updates the values shown; remove it from vbox
+        without destroying it. The rows of a collapsed group are only
+        built when it's expanded for the first time.
+        """
+        self.Profile = prof
+        page = self.Pages.get(prof.Family)
+        if page is None:
+            self.EditWidgets = {}
+            page = (gtk.VBox(False, vbox.get_spacing()), self.EditWidgets)
+            self.BuildPage(page[0])
+            page[0].show_all()
+            self.Pages[prof.Family] = page
+        else:
+            self.EditWidgets = page[1]
+            self.Rebind()
+
+        vbox.pack_start(page[0], False, True, 0)
+
+    def BuildPage(self, vbox):
+        # Split ParamEditOrder into (title, parameters) groups, the rows
+        # keep alternating colors through all groups
+        groups = []
+        for parm in self.Profile.ParamEditOrder:
+            if type(parm) == list:
+                groups.append((parm[0] if len(parm) > 0 else None, []))
+            else:
+                groups[-1][1].append(parm)
+
+        if self.Expanded is None:
+            # By default, only the first group is expanded
+            self.Expanded = set([title for title, parms in groups if title is not None][:1])
+
+        row = 0
+        for title, parms in groups:
+            box = gtk.VBox(False, 1)
+            if title is None:
+                vbox.pack_start(box, False, True, 0)
+                self.BuildRows(parms, box, row)
+            else:
+                expd = gtk.Expander(title)
+                expd.set_border_width(1)
+                expd.set_spacing(3)
+                expd.add(box)
+                vbox.pack_start(expd, False, True, 0)
+                expd.connect("notify::expanded", self.ExpanderToggled, title, parms, box, row)
+                expd.set_expanded(title in self.Expanded)
+            row += len(parms)
+
+    def ExpanderToggled(self, expd, pspec, title, parms, box, row):
+        if expd.get_expanded():
+            self.Expanded.add(title)
+            if not box.get_children():
+                self.BuildRows(parms, box, row)
+                box.show_all()
+        else:
+            self.Expanded.discard(title)
+
+    def BuildRows(self, parms, box, row):
+        prof = self.Profile
+        for parm in parms:
+            desc = prof.ControllerParameters[parm]
+
+            # Place the hbox in a event box to be able to change background color
+            evbox = gtk.EventBox()
+            hbox = gtk.HBox(False, 5)
+            hbox.set_border_width(2)
+            evbox.add(hbox)
+            evbox.set_tooltip_text(desc["Description"])
+            box.pack_start(evbox, False, True, 0)
+
+            label = gtk.Label(desc["Name"])
+            label.set_alignment(0.0, 0.5)
+
+            evbox.modify_bg(gtk.STATE_NORMAL, ROW_COLORS[row & 1])
+            row += 1
+            hbox.pack_start(label, True, True, 0)
+
+            if desc["Widget"] == infineon.PWT_COMBOBOX:
+                minv, maxv = desc["Range"]
+                cb = gtk.combo_box_new_text()
+                for i in range(minv, maxv + 1):
+                    cb.append_text(desc["GetDisplay"](prof, i))
+                self.SetValue(cb, parm, desc)
+                hbox.pack_start(cb, False, True, 0)
+                cb.connect("changed", self.ComboBoxChangeValue, parm, desc)
+                self.EditWidgets[parm] = cb
+
+            elif desc["Widget"] == infineon.PWT_SPINBUTTON:
+                minv, maxv = desc["Range"]
+                spin = gtk.SpinButton(climb_rate=1.0)
+                spin.get_adjustment().configure(minv, minv, maxv, 1, 5, 0)
+                self.SetValue(spin, parm, desc)
+                spin.set_width_chars(7)
+                hbox.pack_start(spin, False, True, 0)
+                spin.connect("output", self.SpinButtonOutput, parm, desc)
+                spin.connect("input", self.SpinButtonInput, parm, desc)
+                spin.connect("value-changed", self.SpinButtonValueChanged, parm, desc)
+                self.EditWidgets[parm] = spin
+
+            elif desc["Widget"] == infineon.PWT_CHECKBOX:
+                cbut = gtk.CheckButton()
+                self.SetValue(cbut, parm, desc)
+                hbox.pack_start(cbut, False, True, 0)
+                cbut.connect("toggled", self.CheckButToggled, parm, desc)
+                self.EditWidgets[parm] = cbut
+
+    def SetValue(self, widget, parm, desc):
+        """Show the value of a parameter of the current profile"""
+        val = getattr(self.Profile, parm)
+        if desc["Widget"] == infineon.PWT_COMBOBOX:
+            widget.set_active(val - desc["Range"][0])
+        elif desc["Widget"] == infineon.PWT_SPINBUTTON:
+            try:
+                val = desc["SetDisplay"](self.Profile, val)
+            except IndexError:
+                val = desc["Default"]
+            widget.set_value(val)
+            # The displayed value may depend on other parameters
+            self.SpinButtonOutput(widget, parm, desc)
+        elif desc["Widget"] == infineon.PWT_CHECKBOX:
+            widget.set_active(val)
+
+    def Rebind(self):
+        """Show the values of the current profile in the built widgets"""
+        self.Binding = True
+        try:
+            for parm, widget in self.EditWidgets.items():
+                self.SetValue(widget, parm, self.Profile.ControllerParameters[parm])
+        finally:
+            self.Binding = False
+
+    def ComboBoxChangeValue(self, cb, parm, desc):
+        if self.Binding:
+            return
+        minv, maxv = desc["Range"]
+        setattr(self.Profile, parm, minv + cb.get_active())
+        # Check if any depending controls needs updating; the rows of
+        # groups which were never expanded are built with current values
+        for iparm in self.Profile.GetDependents(parm):
+            if iparm in self.EditWidgets:
+                self.EditWidgets[iparm].update()
+
+    def SpinButtonOutput(self, spin, parm, desc):
+        if desc.get("Units") is None:
+            mask = "%%.%df" % desc.get("Precision", 1)
+        else:
+            mask = "%%.%df %s" % (desc.get("Precision", 1), desc.get("Units", "").replace('%', '%%'))
+        spin.set_text(mask % desc["GetDisplay"](self.Profile, spin.props.adjustment.value))
+        return True
+
+    # gptr hack, see http://www.mail-archive.com/pygtk@daa.com.au/msg16384.html
+    def SpinButtonInput(self, spin, gptr, parm, desc):
+        text = spin.get_text().strip()
+        if "Units" in desc:
+            try:
+                text = text[:text.rindex(desc["Units"])]
+            except ValueError:
+                pass
+        try:
+            val = float(desc["SetDisplay"](self.Profile, float(text.strip())))
+        except ValueError:
+            val = spin.props.adjustment.value
+
+        double = ctypes.c_double.from_address(hash(gptr))
+        double.value = val
+        return True
+
+    # don't allow the displayed value to go below zero
+    def SpinButtonValueChanged(self, spin, parm, desc):
+        if self.Binding:
+            return
+        while desc["GetDisplay"](self.Profile, spin.props.adjustment.value) < 0:
+            spin.props.adjustment.value += 1
+        val = desc["GetDisplay"](self.Profile, spin.props.adjustment.value)
+        prec = desc.get("Precision", 1)
+        val = round(val * math.pow(10, prec)) / math.pow(10, prec)
+        setattr(self.Profile, parm, val)
+
+    def CheckButToggled(self, cbut, parm, desc):
+        if self.Binding:
+            return
+        val = cbut.get_active()
+        if val:
+            val = 1
+        else:
+            val = 0
+        setattr(self.Profile, parm, val)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Controller emulator on a pseudo-terminal, for testing and benchmarking
+# the serial protocols without hardware (POSIX only)
+#
+
+import os
+import pty
+import tty
+import time
+import random
+import select
+import threading
+from functools import reduce
+from operator import xor
+from xpdm import infineon
+
+# Emulator states
+ES_BOOT = 0
+ES_READY = 1
+ES_RECEIVE = 2
+
+# Controller replies to an uploaded frame
+REPLY_SHORT = b'\xa1'
+REPLY_BROKEN = b'\xa2'
+
+# A partial frame is considered short after this much silence, seconds
+FRAME_TIMEOUT = 0.1
+
+
+class Emulator:
+    """Plays the controller side of a family's serial protocol on a pty
+    pair. Upload and Download open Port like a real serial port.
+
+    After a (re)boot the controller writes the Garbage bytes, then after
+    ReadyDelay seconds (the operator pressing the cable button) answers
+    a '8' probe with 'U' and receives a frame. A good frame is answered
+    with "QR" (EB3xx/KH6xx) or 'U' (EB2xx) and becomes the stored image;
+    a short or broken one with 0xa1 or 0xa2 (EB3xx/KH6xx only). The
+    controller reboots after every upload. A 'U' query outside a frame
+    is answered with the stored Image, which defaults to the image of a
+    profile with the family's default settings.
+
+    Every reply is sent Latency seconds (plus up to Jitter seconds at
+    random) after the request, and every byte is lost in either direction
+    with probability Loss. With a Baud rate, data takes as long to pass
+    as it would on a serial line with BitsPerByte bits per character.
+    """
+
+    def __init__(self, Family, Image=None, Latency=0.0, Loss=0.0, Garbage=b"",
+                 ReadyDelay=0.0, Seed=None, Jitter=0.0, Baud=None, BitsPerByte=10):
+        if isinstance(Family, str):
+            Family = infineon.FindFamily(Family)
+        self.Family = Family
+        self.Length = Family.Codec.Length
+        if Image is None:
+            Image = Family.CreateProfile("emulator").BuildRaw()
+        self.Image = bytes(Image)
+        self.Latency = Latency
+        self.Loss = Loss
+        self.Garbage = bytes(Garbage)
+        self.ReadyDelay = ReadyDelay
+        self.Jitter = Jitter
+        # Seconds per character on the line
+        self.CharTime = 0.0
+        if Baud:
+            self.CharTime = float(BitsPerByte) / Baud
+        self.Random = random.Random(Seed)
+        # EB2xx acknowledges with 'U' and does not report errors
+        self.Ack = b"QR"
+        if Family.ProfileClass.Upload is not infineon.Profile.Upload_EB3xx_KH6xx:
+            self.Ack = b"U"
+
+        self.Uploads = 0
+        self.Downloads = 0
+        self.Errors = 0
+        self.BytesIn = 0
+        self.BytesOut = 0
+
+        self.Master, self.Slave = pty.openpty()
+        # No echo or line editing before the host opens the port
+        tty.setraw(self.Slave)
+        self.Port = os.ttyname(self.Slave)
+
+        self.Running = True
+        self.Boot()
+        self.Thread = threading.Thread(target=self.Run, name="xpd-emulator", daemon=True)
+        self.Thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.Close()
+
+    def Close(self):
+        if not self.Running:
+            return
+        self.Running = False
+        self.Thread.join()
+        os.close(self.Master)
+        os.close(self.Slave)
+
+    def Boot(self):
+        self.State = ES_BOOT
+        self.ReadyTime = time.monotonic() + self.ReadyDelay
+        self.Frame = bytearray()
+        if self.Garbage:
+            self.Send(self.Garbage, False)
+
+    def Send(self, data, delay=True):
+        if delay and (self.Latency > 0 or self.Jitter > 0):
+            time.sleep(self.Latency + self.Random.uniform(0, self.Jitter))
+        if self.Loss > 0:
+            data = bytes(c for c in data if self.Random.random() >= self.Loss)
+        self.BytesOut += len(data)
+        if self.CharTime > 0:
+            # Pace the output like the line would
+            start = time.monotonic()
+            for i in range(len(data)):
+                os.write(self.Master, data[i:i + 1])
+                time.sleep(max(0.0, start + (i + 1) * self.CharTime - time.monotonic()))
+            return
+        while data:
+            data = data[os.write(self.Master, data):]
+
+    def Run(self):
+        while self.Running:
+            r, w, x = select.select([self.Master], [], [], FRAME_TIMEOUT)
+            if not r:
+                if self.State == ES_RECEIVE:
+                    self.FrameDone()
+                continue
+
+            try:
+                data = os.read(self.Master, 4096)
+            except OSError:
+                # Nobody has the port open
+                time.sleep(FRAME_TIMEOUT)
+                continue
+
+            self.BytesIn += len(data)
+            if self.CharTime > 0:
+                # The host writes at once, the line would take this long
+                time.sleep(len(data) * self.CharTime)
+            if self.Loss > 0:
+                data = bytes(c for c in data if self.Random.random() >= self.Loss)
+            for c in data:
+                self.Received(c)
+
+    def Received(self, c):
+        if self.State == ES_RECEIVE:
+            self.Frame.append(c)
+            if len(self.Frame) == self.Length:
+                self.FrameDone()
+            return
+
+        if c == ord('U'):
+            # Download query
+            self.Downloads += 1
+            self.Send(self.Image)
+        elif c == ord('8'):
+            if self.State == ES_BOOT and time.monotonic() >= self.ReadyTime:
+                self.State = ES_READY
+            if self.State == ES_READY:
+                self.State = ES_RECEIVE
+                self.Frame = bytearray()
+                self.Send(b'U')
+
+    def FrameDone(self):
+        if len(self.Frame) < self.Length:
+            reply = REPLY_SHORT
+        elif reduce(xor, self.Frame, 0) != 0:
+            reply = REPLY_BROKEN
+        else:
+            self.Uploads += 1
+            self.Image = bytes(self.Frame)
+            self.Send(self.Ack)
+            self.Boot()
+            return
+
+        self.Errors += 1
+        if self.Ack != b"U":
+            self.Send(reply)
+        self.State = ES_READY
@@ -4,7 +4,6 @@
 
 import os
 import sys
-import glob
 import copy
 import pygtk
 import gtk
@@ -14,8 +13,16 @@ import gio
 import pango
 import time
 import locale
-from xpdm import VERSION, FNENC, comports
-from xpdm import infineon, EB2xx, EB3xx, KH6xx
+import threading
+from xpdm import VERSION, comports
+from xpdm import infineon, library, watcher, hotplug, editor, transport, stationgui
+from xpdm import handshake, serialpool, trace, progress
+from xpdm import EB2xx, EB3xx, KH6xx
+
+# Profile load errors listed in the summary after a scan
+SCAN_ERRORS_SHOWN = 10
+# How often to rescan the profile directories if they can't be watched, s
+PROFILE_POLL_INTERVAL = 5
 
 
 #-----------------------------------------------------------------------------
@@ -23,8 +30,13 @@ from xpdm import infineon, EB2xx, EB3xx, KH6xx
 #-----------------------------------------------------------------------------
 class Application:
     def __init__(self):
+        # The session loop and the profile scanner call back from their own
+        # threads; GLib must know about threads before the first one starts
+        gobject.threads_init()
+
         self.Dead = False
         self.ActiveProfile = None
+        self.Editor = editor.ParameterEditor()
 
         # Figure out our installation paths
         self.DATADIR = os.path.join(os.path.dirname(os.path.abspath(
@@ -52,6 +64,13 @@ class Application:
         print("Local program data directory:", self.LOCALDATADIR)
         print("User config directory:", self.CONFIGDIR)
 
+        # The cached list of profiles found in the above directories
+        self.Library = library.ProfileIndex(os.path.join(self.CONFIGDIR, "profiles.json"))
+
+        # Controller handshake timings, used to tune the handshake
+        self.HandshakeStats = os.path.join(self.CONFIGDIR, "handshake.json")
+        handshake.Stats.Load(self.HandshakeStats)
+
     def Initialize(self, textdomain):
         # Load the widgets from the GtkBuilder file
         self.builder = gtk.Builder()
@@ -63,7 +82,7 @@ class Application:
 
         # Cache most used widgets into variables
         for widget in ("AboutDialog",
-                       "MainWindow", "StatusBar", "SerialPortsList", "ProfileList",
+                       "MainWindow", "StatusBar", "SerialPortsList", "CheckVerify", "ProfileList",
                        "ParamVBox", "UserChoice", "UserHints",
                        "CreateProfileDialog", "CreateProfileName", "CreateControllerFamily",
                        "EditProfileDialog", "ProfileName", "ControllerFamily",
@@ -85,19 +104,44 @@ class Application:
 
         self.StatusCtx = self.StatusBar.get_context_id("")
 
+        # Serial sessions run in the background, reporting back through idle callbacks
+        self.Sessions = transport.SessionLoop(glib.idle_add)
+        # progress.Throttle of the transfer in progress
+        self.Transfer = None
+
         self.builder.connect_signals(self)
 
         self.InitProfileList()
+        self.Scanner = None
+        self.ScanAgain = False
+        self.ScanQuiet = False
+        self.ScanStale = set()
         self.LoadProfiles()
 
+        # Pick up profiles added, changed or removed by other programs:
+        # use file monitors if available, otherwise rescan periodically
+        self.ProfileWatcher = watcher.ProfileWatcher(
+            (self.DATADIR, self.LOCALDATADIR, self.CONFIGDIR), self.on_ProfileFile_changed)
+        if not self.ProfileWatcher.Active():
+            print("Profile directory monitors not available, polling")
+            glib.timeout_add_seconds(PROFILE_POLL_INTERVAL, self.RefreshProfiles)
+
         self.FillFamilies(self.ControllerFamily)
         self.FillFamilies(self.CreateControllerFamily)
         self.FillGroups(self.DownloadControllerGroup)
 
-        # Dynamic serial port list update worker
+        # Dynamic serial port list update: use hotplug events if available,
+        # otherwise poll the list of serial ports every second
         self.SerialPortsHash = None
+        self.SerialPortsPending = False
         self.UpdateSerialPorts()
-        glib.timeout_add_seconds(1, self.RefreshSerialPorts)
+        try:
+            self.PortMonitor = hotplug.PortMonitor()
+            glib.io_add_watch(self.PortMonitor.fileno(), glib.IO_IN, self.on_PortMonitor_event)
+        except OSError as e:
+            print("Serial port hotplug events not available (%s), polling" % e)
+            self.PortMonitor = None
+            glib.timeout_add_seconds(1, self.RefreshSerialPorts)
 
         # Enable image buttons on Windows; on Linux you can change it via preferences
         if os.name == "nt":
@@ -125,6 +169,8 @@ class Application:
 
     def InitProfileList(self):
         self.ProfileListStore = gtk.ListStore(str, str, str, str)
+        # File name -> list store iter
+        self.ProfileRows = {}
 
         self.ProfileList.set_model(self.ProfileListStore)
 
@@ -168,6 +214,35 @@ class Application:
         self.UpdateSerialPorts(spl, sph)
         return True
 
+    def on_PortMonitor_event(self, fd, cond):
+        if self.Dead:
+            return False
+        events = self.PortMonitor.Read()
+        for action, port in events:
+            if action == "remove":
+                # Ports kept open by the pool are gone with the device,
+                # even if a port of the same name comes back right away
+                serialpool.Pool.Close(port)
+        if events and not self.SerialPortsPending:
+            self.SerialPortsPending = True
+            glib.idle_add(self.ApplySerialPortsChange)
+        return True
+
+    def ApplySerialPortsChange(self):
+        if self.Dead:
+            return False
+        if self.ButtonCancelUpload.get_visible():
+            # Don't disturb a transfer in progress, look again later
+            glib.timeout_add_seconds(1, self.ApplySerialPortsChange)
+            return False
+
+        self.SerialPortsPending = False
+        # A port may have been replugged under the same name, the hash of
+        # the names does not show that
+        self.SerialPortsHash = None
+        self.RefreshSerialPorts()
+        return False
+
     def UpdateSerialPorts(self, spl=None, sph=None):
         if spl is None:
             spl = []
@@ -187,6 +262,10 @@ class Application:
             self.SerialPortsList.set_model(store)
         else:
             selport = self.SerialPortsList.get_active_text()
+            # Ports kept open by the pool are gone with the device
+            for row in store:
+                if row[0] not in spl:
+                    serialpool.Pool.Close(row[0])
 
         store.clear()
         idx = 0
@@ -202,6 +281,8 @@ class Application:
         self.SetStatus(_("Serial ports list updated"))
 
     def UpdateProgress(self, pos=None, msg=None):
+        if self.Dead:
+            return
         if msg is not None:
             self.SetStatus(msg)
         if pos is None:
@@ -210,22 +291,53 @@ class Application:
             if pos > 1.0:
                 pos = 1.0
             self.ProgressBar.set_fraction(pos)
-        while gtk.events_pending():
-            gtk.main_iteration()
 
+    def ReportProgress(self, pos, msg):
+        # Called in the session loop thread, at most progress.FRAME_RATE times a second
+        self.Sessions.Post(self.UpdateProgress, pos, msg)
         return not (self.UploadCancelled or self.Dead)
 
-    def EditProfile(self, prof, oldsel=None):
+    def StartTransfer(self, status, hints, prof, tracefn, start, finished):
+        """Run a serial transfer on the session loop, so that the main loop
+        stays responsive. start(progress_func) returns the transfer
+        coroutine; finished(result, error) is called in the main loop
+        once it's over and the window is back to the profile list.
+        """
+        self.UploadCancelled = False
+        self.SetStatus(status)
+        self.UserHints.set_label(hints)
+        self.UserChoice.hide()
+        self.UserHints.show()
+        self.ProgressBar.show()
+        self.ButtonCancelUpload.show()
+        self.MainWindow.set_deletable(False)
+
+        # Keep the port traffic of the last session for troubleshooting
+        writer = trace.Record(prof, os.path.join(self.CONFIGDIR, tracefn))
+        self.Transfer = progress.Throttle(self.ReportProgress)
+
+        def Done(res, err):
+            writer.Close()
+            self.Transfer = None
+            if self.Dead:
+                return
+            self.MainWindow.set_deletable(True)
+            self.ButtonCancelUpload.hide()
+            self.ProgressBar.hide()
+            self.UserHints.hide()
+            self.UserChoice.show()
+            finished(res, err)
+
+        self.Sessions.Submit(start(self.Transfer), Done)
+
+    def EditProfile(self, prof):
         if prof is None:
             return
 
-        if oldsel is None:
-            selected_prof = prof.Description[:]
-        else:
-            selected_prof = oldsel
+        oldfn = library.DecodeFileName(prof.FileName)
         self.ProfileName.set_text(prof.Description)
         self.SelectFamily(prof.Family)
-        prof.FillParameters(self.ParamVBox)
+        self.Editor.FillParameters(prof, self.ParamVBox)
 
         self.ActiveProfile = prof
 
@@ -237,70 +349,166 @@ class Application:
         prof = self.ActiveProfile
         self.ActiveProfile = None
 
-        if ok:
-            # Rename profile, if profile name changed
-            try:
-                newname = self.ProfileName.get_text().strip()
-                if newname != prof.Description:
-                    prof.SetDescription(newname)
-                    selected_prof = newname[:]
-                    self.SetStatus(_("Profile renamed"))
-            except OSError as e:
-                self.Message(gtk.MESSAGE_ERROR,
-                             _("Failed to rename profile %(desc)s:\n%(msg)s") %
-                             {"desc": prof.Description, "msg": e})
-                self.SetStatus(_("Failed to rename profile"))
+        if not ok:
+            return
 
-            # Save profile, if we have enough access rights
+        # Rename profile, if profile name changed
+        try:
+            newname = self.ProfileName.get_text().strip()
+            if newname != prof.Description:
+                prof.SetDescription(newname)
+                self.SetStatus(_("Profile renamed"))
+        except OSError as e:
+            self.Message(gtk.MESSAGE_ERROR,
+                         _("Failed to rename profile %(desc)s:\n%(msg)s") %
+                         {"desc": prof.Description, "msg": e})
+            self.SetStatus(_("Failed to rename profile"))
+
+        # Save profile, if we have enough access rights
+        try:
+            prof.Save()
+            self.SetStatus(_("Profile saved"))
+        except IOError as e:
+            self.Message(gtk.MESSAGE_ERROR,
+                         _("Failed to save profile %(desc)s:\n%(msg)s") %
+                         {"desc": prof.Description, "msg": e})
+            self.SetStatus(_("Failed to save profile"))
+
+        # Only the rows of the old and new profile file need updating
+        newfn = library.DecodeFileName(prof.FileName)
+        if oldfn != newfn:
+            self.UpdateProfileRow(oldfn)
+        it = self.UpdateProfileRow(newfn)
+        if it is not None:
+            self.ProfileList.get_selection().select_iter(it)
+        self.SaveLibrary()
+
+    def UpdateProfileRow(self, fn):
+        """Bring the list row of a single profile file up to date with the
+        file on disk, returns the row iter or None if there's no such row.
+        """
+        it = self.ProfileRows.pop(fn, None)
+        ent = None
+        if os.access(fn, os.F_OK):
             try:
-                prof.Save()
-                selected_prof = prof.Description[:]
-                self.SetStatus(_("Profile saved"))
+                ent = self.Library.Update(fn)
             except IOError as e:
-                self.Message(gtk.MESSAGE_ERROR,
-                             _("Failed to save profile %(desc)s:\n%(msg)s") %
-                             {"desc": prof.Description, "msg": e})
-                self.SetStatus(_("Failed to save profile"))
+                self.SetStatus(_("Failed to load profile %(fn)s: %(msg)s") %
+                               {"fn": fn, "msg": str(e.strerror)})
+            except Exception as e:
+                self.SetStatus(_("Failed to load profile %(fn)s: %(msg)s") %
+                               {"fn": fn, "msg": e})
+        else:
+            self.Library.Remove(fn)
 
-        self.LoadProfiles(selected_prof)
+        if (ent is None) or (ent["family"] is None):
+            if it is not None:
+                self.ProfileListStore.remove(it)
+            return None
 
-    def LoadProfiles(self, sel=None):
-        # Remember the old selection, before re-filling the list
-        model = self.ProfileList.get_model()
-        if not sel:
-            sel = self.ProfileList.get_selection().get_selected()[1]
-            if sel:
-                sel = model[sel][2]
-
-        self.ProfileListStore.clear()
-        # Python bug: glob() with unicode argument will use locale.getpreferredencoding()
-        # for file name encoding, which is not compatible with glib filename encodings
-        for x in glob.glob(os.path.join(self.DATADIR.encode(FNENC), "*.asv")) + \
-                 glob.glob(os.path.join(self.LOCALDATADIR.encode(FNENC), "*.asv")) + \
-                 glob.glob(os.path.join(self.CONFIGDIR.encode(FNENC), "*.asv")):
-            try:
-                prof = self.LoadProfile(x.decode(FNENC))
-                if not (prof is None):
-                    self.ProfileListStore.append(
-                        (prof.Family, prof.GetModel(), prof.Description,
-                         prof.FileName))
-            except IOError as e:
-                self.Message(gtk.MESSAGE_WARNING,
-                             _("Failed to load profile %(fn)s:\n%(msg)s") %
-                             {"fn": x, "msg": str(e.strerror)})
-            except ValueError as e:
-                self.Message(gtk.MESSAGE_WARNING,
-                             _("Failed to load profile %(fn)s:\n%(msg)s") %
-                             {"fn": x, "msg": e})
-
-        # Re-select previously selected profile
-        if sel:
-            i = model.get_iter_first()
-            while i:
-                if model[i][2] == sel:
-                    self.ProfileList.get_selection().select_iter(i)
-                    break
-                i = model.iter_next(i)
+        if it is None:
+            it = self.ProfileListStore.append(
+                (ent["family"], ent["model"], ent["description"], fn))
+        else:
+            self.ProfileListStore.set(it, 0, ent["family"], 1, ent["model"],
+                                      2, ent["description"])
+        self.ProfileRows[fn] = it
+        return it
+
+    def SaveLibrary(self):
+        try:
+            self.Library.Save()
+        except IOError as e:
+            print("Failed to save profile index:", e)
+
+    def LoadProfiles(self, sel=None, quiet=False):
+        """Bring the profile list up to date with the profile directories,
+        selecting the profile file sel once it's listed. The files are
+        scanned in the background; rows are added, changed and removed as
+        the results come in, so the rows which did not change (and the
+        selection) stay as they are. Errors are reported together at the
+        end, unless quiet. While a scan is running, another one is only
+        started after it finishes.
+        """
+        if self.Scanner is not None:
+            self.ScanAgain = True
+            self.ScanQuiet = self.ScanQuiet and quiet
+            if sel is not None:
+                self.ScanSelection = sel
+            return
+
+        self.ScanAgain = False
+        self.ScanQuiet = quiet
+        self.ScanSelection = sel
+        # Rows of the files not found by the scan are removed at the end
+        self.ScanStale = set(self.ProfileRows.keys())
+
+        # Only the files changed since the last scan are actually parsed
+        dirs = (self.DATADIR, self.LOCALDATADIR, self.CONFIGDIR)
+        self.Scanner = threading.Thread(target=self.ScanProfiles, args=(dirs,),
+                                        name="xpd-scan", daemon=True)
+        self.Scanner.start()
+
+    def ScanProfiles(self, dirs):
+        # Runs in the scanner thread
+        try:
+            rows, errors = self.Library.Scan(
+                dirs, lambda rows, errors: self.Sessions.Post(self.AddProfileRows, rows))
+        except Exception as e:
+            rows, errors = [], [(", ".join(dirs), str(e))]
+        self.Sessions.Post(self.ScanFinished, len(rows), errors)
+
+    def AddProfileRows(self, rows):
+        if self.Dead:
+            return
+        for row in rows:
+            fn = row[3]
+            self.ScanStale.discard(fn)
+            it = self.ProfileRows.get(fn)
+            if it is None:
+                it = self.ProfileListStore.append(row)
+                self.ProfileRows[fn] = it
+            elif tuple(self.ProfileListStore[it])[:3] != tuple(row[:3]):
+                self.ProfileListStore.set(it, 0, row[0], 1, row[1], 2, row[2])
+
+            if fn == self.ScanSelection:
+                self.ProfileList.get_selection().select_iter(it)
+                self.ScanSelection = None
+
+    def ScanFinished(self, count, errors):
+        self.Scanner = None
+        if self.Dead:
+            return
+        if self.ScanAgain:
+            # The files changed during the scan, the next scan finishes the job
+            self.LoadProfiles(self.ScanSelection, self.ScanQuiet)
+            return
+
+        for fn in self.ScanStale:
+            it = self.ProfileRows.pop(fn, None)
+            if it is not None:
+                self.ProfileListStore.remove(it)
+        self.ScanStale = set()
+
+        self.SaveLibrary()
+        if self.ScanQuiet:
+            return
+        self.SetStatus(_("Loaded %(n)d profiles") % {"n": count})
+        if errors:
+            msg = "\n".join(_("%(fn)s: %(msg)s") % {"fn": fn, "msg": msg}
+                            for fn, msg in errors[:SCAN_ERRORS_SHOWN])
+            if len(errors) > SCAN_ERRORS_SHOWN:
+                msg += "\n" + _("... and %(n)d more") % {"n": len(errors) - SCAN_ERRORS_SHOWN}
+            self.Message(gtk.MESSAGE_WARNING,
+                         _("Failed to load %(n)d profiles:\n%(msg)s") %
+                         {"n": len(errors), "msg": msg})
+
+    def RefreshProfiles(self):
+        # Timer callback when the profile directories can't be watched
+        if self.Dead:
+            return False
+        self.LoadProfiles(quiet=True)
+        return True
 
     def FillFamilies(self, lbox):
         store = gtk.ListStore(str)
@@ -404,26 +612,7 @@ class Application:
         return None, None
 
     def LoadProfile(self, fn):
-        with open(fn, "r", encoding=FNENC) as f:
-            l = f.readlines()
-        prof = None
-        for fam in infineon.Families:
-            if fam.DetectFormat(l):
-                prof = fam.CreateProfile(fn)
-                break
-
-        if prof is not None:
-            prof.Load(fn, l)
-
-        return prof
-
-    def GetSelectedProfile(self):
-        sel = self.ProfileList.get_selection().get_selected()[1]
-        if not sel:
-            self.SetStatus(_("No profile selected"))
-            return None
-
-        return self.ProfileListStore[sel][2]
+        return library.LoadProfile(fn)
 
     def LoadSelectedProfile(self):
         sel = self.ProfileList.get_selection().get_selected()[1]
@@ -435,13 +624,28 @@ class Application:
 
     # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
 
+    def on_ProfileFile_changed(self, fn):
+        self.UpdateProfileRow(fn)
+        self.SaveLibrary()
+
     def on_MainWindow_destroy(self, win):
         self.Dead = True
+        self.ProfileWatcher.Close()
+        if self.PortMonitor is not None:
+            self.PortMonitor.Close()
+        self.Sessions.Close()
+        serialpool.Pool.Close()
+        try:
+            handshake.Stats.Save(self.HandshakeStats)
+        except IOError as e:
+            print("Failed to save handshake statistics:", e)
         self.UploadCancelled = True
         gtk.main_quit()
 
     def on_ButtonCancelUpload_clicked(self, but):
         self.UploadCancelled = True
+        if self.Transfer is not None:
+            self.Transfer.Stop()
 
     def on_ButtonApply_clicked(self, but):
         prof = self.LoadSelectedProfile()
@@ -453,19 +657,7 @@ class Application:
             self.SetStatus(_("No serial port selected"))
             return
 
-        self.UploadCancelled = False
-        self.SetStatus(_("Uploading settings to controller"))
-        self.UserChoice.hide()
-        self.UserHints.show()
-        self.ProgressBar.show()
-        self.ButtonCancelUpload.show()
-        self.ButtonCancelUpload.grab_add()
-        self.MainWindow.set_deletable(False)
-
-        while gtk.events_pending():
-            gtk.main_iteration()
-
-        self.UserHints.set_label(_("""\
+        hints = _("""\
 Applying profile: <b>%(prof)s</b>
 Controller model: <b>%(ctrl)s</b>
 Serial port: <b>%(port)s</b>
@@ -480,28 +672,33 @@ If the controller programs only once (that is, when you're doing it second time,
 the message "Waiting for controller ready" stays forever and program won't react \
 to the cable button) you will need to completely disconnect temporarily either \
 the controller from the cable, or the cable from the USB port.\
-""") % {"prof": prof.Description, "ctrl": prof.GetModel(), "port": serport})
-
-        msg = None
-        try:
-            ok = prof.Upload(serport, self.UpdateProgress)
-            if ok:
+""") % {"prof": prof.Description, "ctrl": prof.GetModel(), "port": serport}
+
+        verify = self.CheckVerify.get_active() and prof.CanVerify()
+
+        def Start(prog):
+            if verify:
+                return prof.UploadVerifyAsync(serport, prog)
+            return prof.UploadAsync(serport, prog)
+
+        def Finished(ok, err):
+            if isinstance(err, infineon.VerifyError):
+                self.SetStatus(_("Upload failed: %(msg)s") % {"msg": str(err)})
+                self.Message(gtk.MESSAGE_ERROR, _("The controller did not take these settings:\n\n") +
+                             "\n".join(_("%(parm)s: uploaded %(up)s, read back %(back)s") %
+                                       {"parm": m[0], "up": m[1], "back": m[2]}
+                                       for m in err.Mismatches))
+            elif err is not None:
+                self.SetStatus(_("Upload failed: %(msg)s") % {"msg": str(err)})
+            elif ok and verify:
+                self.SetStatus(_("Settings uploaded and verified successfully"))
+            elif ok:
                 self.SetStatus(_("Settings uploaded successfully"))
             else:
                 self.SetStatus(_("Upload cancelled"))
 
-        except Exception as e:
-            msg = str(e)
-
-        if msg is not None:
-            self.SetStatus(_("Upload failed: %(msg)s") % {"msg": str(e)})
-
-        self.MainWindow.set_deletable(True)
-        self.ButtonCancelUpload.grab_remove()
-        self.ButtonCancelUpload.hide()
-        self.ProgressBar.hide()
-        self.UserHints.hide()
-        self.UserChoice.show()
+        self.StartTransfer(_("Uploading settings to controller"), hints, prof,
+                           "last-upload.xpt", Start, Finished)
 
     def on_ButtonEdit_clicked(self, but):
         prof = self.LoadSelectedProfile()
@@ -520,7 +717,7 @@ the controller from the cable, or the cable from the USB port.\
             fam = self.SelectedFamily(self.CreateControllerFamily)
             nam = self.CreateProfileName.get_text().strip()
             prof = fam.CreateProfile(os.path.join(self.CONFIGDIR, nam))
-            self.EditProfile(prof, self.GetSelectedProfile())
+            self.EditProfile(prof)
 
     def on_ButtonCopy_clicked(self, but):
         prof = self.LoadSelectedProfile()
@@ -529,7 +726,7 @@ the controller from the cable, or the cable from the USB port.\
 
         prof.SetFileName(os.path.join(self.CONFIGDIR, _("New ") +
                         prof.Description + ".asv"), False)
-        self.EditProfile(prof, self.GetSelectedProfile())
+        self.EditProfile(prof)
 
     def on_ButtonDelete_clicked(self, but):
         prof = self.LoadSelectedProfile()
@@ -544,7 +741,8 @@ the controller from the cable, or the cable from the USB port.\
         if rc == gtk.RESPONSE_OK:
             try:
                 prof.Remove()
-                self.LoadProfiles()
+                self.UpdateProfileRow(library.DecodeFileName(prof.FileName))
+                self.SaveLibrary()
                 self.SetStatus(_("Profile deleted"))
             except:
                 self.Message(gtk.MESSAGE_ERROR,
@@ -570,19 +768,7 @@ the controller from the cable, or the cable from the USB port.\
             nam = self.DownloadProfileName.get_text().strip()
             prof = fam.CreateProfile(os.path.join(self.CONFIGDIR, nam))
 
-            self.UploadCancelled = False
-            self.SetStatus(_("Reading profile from controller"))
-            self.UserChoice.hide()
-            self.UserHints.show()
-            self.ProgressBar.show()
-            self.ButtonCancelUpload.show()
-            self.ButtonCancelUpload.grab_add()
-            self.MainWindow.set_deletable(False)
-
-            while gtk.events_pending():
-                gtk.main_iteration()
-
-            self.UserHints.set_label(_("""\
+            hints = _("""\
 Creating profile: <b>%(prof)s</b>
 Controller family: <b>%(family)s</b>
 Controller subgroup: <b>%(group)s</b>
@@ -592,30 +778,28 @@ Trying to read controller profile data.
 
 Not all controller types support reading.
 """) % {"prof": prof.Description, "family": prof.Family, "port": serport,
-                 "group": wc or _("all")})
+                 "group": wc or _("all")}
 
-            msg = None
-            try:
-                ok = prof.Download(serport, self.UpdateProgress, wc)
-                if ok:
+            def Finished(ok, err):
+                if err is not None:
+                    self.SetStatus(_("Download failed: %(msg)s") % {"msg": str(err)})
+                elif ok:
                     self.SetStatus(_("Settings downloaded successfully"))
+                    self.EditProfile(prof)
                 else:
                     self.SetStatus(_("Download cancelled"))
 
-            except Exception as e:
-                msg = str(e)
-
-            self.MainWindow.set_deletable(True)
-            self.ButtonCancelUpload.grab_remove()
-            self.ButtonCancelUpload.hide()
-            self.ProgressBar.hide()
-            self.UserHints.hide()
-            self.UserChoice.show()
+            self.StartTransfer(_("Reading profile from controller"), hints, prof,
+                               "last-download.xpt",
+                               lambda prog: prof.DownloadAsync(serport, prog, wc), Finished)
 
-            if msg is not None:
-                self.SetStatus(_("Download failed: %(msg)s") % {"msg": str(e)})
-            elif ok:
-                self.EditProfile(prof, self.GetSelectedProfile())
+    def on_ButtonStation_clicked(self, but):
+        fn = None
+        sel = self.ProfileList.get_selection().get_selected()[1]
+        if sel:
+            fn = self.ProfileListStore[sel][3]
+        stationgui.StationWindow(self.MainWindow, self.ProfileListStore, self.LoadProfile,
+                                 self.Sessions, fn)
 
     def on_ButtonAbout_clicked(self, but):
         self.AboutDialog.set_version(VERSION)
@@ -635,7 +819,7 @@ Not all controller types support reading.
         self.ActiveProfile = prof
 
         self.ParamVBox.foreach(self.ClearChildren, self.ParamVBox)
-        prof.FillParameters(self.ParamVBox)
+        self.Editor.FillParameters(prof, self.ParamVBox)
 
     def on_UserHints_size_allocate(self, label, allocation):
         layout = label.get_layout()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# Controller ready handshake: probe scheduling and time-to-ready statistics
+#
+
+import os
+import json
+import time
+import threading
+
+# The tuned probe interval is never shorter than this
+MIN_PROBE_INTERVAL = 0.005
+# Probe interval until the reply latency of a port is known, and the
+# longest one; this was the fixed serial timeout
+MAX_PROBE_INTERVAL = 0.2
+# The tuned probe interval is this many times the slowest reply seen
+LATENCY_MARGIN = 2.0
+# Interval growth factor for every unanswered probe after the hot window
+BACKOFF = 1.5
+# How long to probe at the short interval before backing off, seconds
+HOT_TIME = 3.0
+MIN_HOT_TIME = 1.0
+MAX_HOT_TIME = 30.0
+
+# Samples kept per family and port
+MAX_SAMPLES = 100
+# Samples needed before the schedule is tuned from them
+MIN_SAMPLES = 5
+
+# Bump this when the statistics file layout or meaning changes
+STATS_VERSION = 2
+
+
+def Percentile(samples, pct):
+    if not samples:
+        return None
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(len(s) * pct / 100.0))]
+
+
+class ReadyStats:
+    """Time-to-ready (from the first probe until the controller answers)
+    and reply latency (from the answered probe until the answer) samples
+    per controller family and serial port. Records may come from any
+    thread.
+    """
+
+    def __init__(self):
+        self.Lock = threading.Lock()
+        self.Entries = {}
+        self.Dirty = False
+
+    def Key(self, family, port):
+        return "%s|%s" % (family, port)
+
+    def Record(self, family, port, ready, latency):
+        with self.Lock:
+            ent = self.Entries.setdefault(self.Key(family, port),
+                                          {"ready": [], "latency": []})
+            for name, val in (("ready", ready), ("latency", latency)):
+                ent[name].append(round(val, 4))
+                del ent[name][:-MAX_SAMPLES]
+            self.Dirty = True
+
+    def Samples(self, family, port, name):
+        with self.Lock:
+            ent = self.Entries.get(self.Key(family, port))
+            if ent is None:
+                return []
+            return list(ent[name])
+
+    def Summary(self, family, port):
+        """Return (count, median time-to-ready, 95th percentile reply
+        latency) for a family and port, or None if there are no samples
+        """
+        ready = self.Samples(family, port, "ready")
+        if not ready:
+            return None
+        return (len(ready), Percentile(ready, 50),
+                Percentile(self.Samples(family, port, "latency"), 95))
+
+    def Load(self, fn):
+        try:
+            with open(fn, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+        if data.get("version") != STATS_VERSION:
+            return
+        with self.Lock:
+            self.Entries = data.get("ports", {})
+            self.Dirty = False
+
+    def Save(self, fn):
+        with self.Lock:
+            if not self.Dirty:
+                return
+            data = json.dumps({"version": STATS_VERSION, "ports": self.Entries})
+            self.Dirty = False
+
+        tmp = fn + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp, fn)
+
+
+# Statistics from all handshakes in this process
+Stats = ReadyStats()
+
+
+class Schedule:
+    """Probe timing for the ready handshake on a port. Only one probe is
+    ever unanswered: the next one is sent when no reply came within the
+    probe interval. A ready controller takes any probe arriving after its
+    'U' reply for the first byte of the frame, so the interval must not
+    be shorter than the reply latency.
+
+    Until there are enough samples for the family and port, probes are
+    sent at the old fixed serial timeout. Then the interval follows the
+    slowest reply seen, for a hot window following the observed
+    time-to-ready, after which it backs off to the old timeout again.
+    """
+
+    def __init__(self, Family, Port):
+        self.Family = Family
+        self.Port = Port
+        self.Interval = MAX_PROBE_INTERVAL
+        self.HotTime = HOT_TIME
+
+        latency = Stats.Samples(Family, Port, "latency")
+        ready = Stats.Samples(Family, Port, "ready")
+        if len(ready) >= MIN_SAMPLES:
+            # The answer to a probe comes before the next probe is sent;
+            # the window covers most operators' timing
+            self.Interval = min(MAX_PROBE_INTERVAL,
+                                max(MIN_PROBE_INTERVAL, LATENCY_MARGIN * max(latency)))
+            self.HotTime = min(MAX_HOT_TIME, max(MIN_HOT_TIME, Percentile(ready, 90)))
+
+        self.Start = None
+        self.Probe = None
+        self.Timeout = self.Interval
+
+    def Next(self):
+        """Return how long to wait for a reply to the next probe"""
+        now = time.monotonic()
+        if self.Start is None:
+            self.Start = now
+        elif now - self.Start > self.HotTime:
+            self.Timeout = min(MAX_PROBE_INTERVAL, self.Timeout * BACKOFF)
+        return self.Timeout
+
+    def Sent(self):
+        """Note the time a probe was sent; the previous one was not
+        answered within its timeout
+        """
+        self.Probe = time.monotonic()
+
+    def Ready(self):
+        """The controller answered the unanswered probe, record the
+        statistics
+        """
+        now = time.monotonic()
+        Stats.Record(self.Family, self.Port, now - self.Start, now - (self.Probe or self.Start))
+
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Serial port hotplug notifications from Linux kernel uevents
+#
+
+import os
+import socket
+import select
+import struct
+from fnmatch import fnmatchcase
+from xpdm.scan_posix import PORT_PATTERNS
+
+# From <linux/netlink.h>
+NETLINK_KOBJECT_UEVENT = 15
+# Multicast group of the uevents sent by the kernel
+UEVENT_KERNEL_GROUP = 1
+# Multicast group of the uevents re-broadcast by udev once it has created
+# the device node and set its permissions
+UEVENT_UDEV_GROUP = 2
+
+# Exists while udev is running
+UDEV_CONTROL = "/run/udev/control"
+
+# udev message header: "libudev\0", magic (big endian), header size,
+# offset and length of the properties
+UDEV_PREFIX = b"libudev\0"
+UDEV_MAGIC = 0xfeedcafe
+UDEV_HEADER = struct.Struct("=8sIIII")
+
+
+class PortMonitor:
+    """Listens to uevents and reports serial ports which appear or
+    disappear as a list of (action, port) tuples, action being "add" or
+    "remove". The events come from udev, so the port can be opened when
+    "add" is reported; without udev, the kernel events are used. Raises
+    OSError if uevents are not available (e.g. not Linux), in which case
+    the caller should fall back to polling comports().
+    """
+
+    def __init__(self):
+        if not hasattr(socket, "AF_NETLINK"):
+            raise OSError("Netlink sockets are not supported on this system")
+
+        group = UEVENT_KERNEL_GROUP
+        if os.path.exists(UDEV_CONTROL):
+            group = UEVENT_UDEV_GROUP
+
+        self.Socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                                    NETLINK_KOBJECT_UEVENT)
+        try:
+            self.Socket.bind((0, group))
+        except OSError:
+            self.Socket.close()
+            raise
+        self.Socket.setblocking(False)
+
+    def fileno(self):
+        return self.Socket.fileno()
+
+    def Close(self):
+        self.Socket.close()
+
+    def Parse(self, msg):
+        if msg.startswith(UDEV_PREFIX):
+            # udev header, then "KEY=VALUE\0KEY=VALUE..."
+            if len(msg) < UDEV_HEADER.size:
+                return None
+            prefix, magic, size, ofs, length = UDEV_HEADER.unpack_from(msg)
+            if socket.ntohl(magic) != UDEV_MAGIC:
+                return None
+            fields = msg[ofs:ofs + length].split(b'\0')
+        else:
+            # Kernel: "ACTION@DEVPATH\0KEY=VALUE\0KEY=VALUE..."
+            fields = msg.split(b'\0')[1:]
+
+        env = {}
+        for field in fields:
+            key, sep, val = field.partition(b'=')
+            if sep:
+                env[key] = val.decode("utf-8", "replace")
+
+        if env.get(b"SUBSYSTEM") != "tty" or (b"DEVNAME" not in env):
+            return None
+        action = env.get(b"ACTION")
+        if action not in ("add", "remove"):
+            return None
+
+        port = env[b"DEVNAME"]
+        if not port.startswith("/"):
+            port = os.path.join("/dev", port)
+        for pattern in PORT_PATTERNS:
+            if fnmatchcase(port, pattern):
+                return action, port
+        return None
+
+    def Read(self):
+        """Return all the pending port events without blocking"""
+        events = []
+        while True:
+            try:
+                msg = self.Socket.recv(16384)
+            except (BlockingIOError, InterruptedError):
+                break
+            ev = self.Parse(msg)
+            if ev is not None:
+                events.append(ev)
+        return events
+
+    def Wait(self, timeout=None):
+        """Block until some port events arrive or the timeout (in seconds)
+        expires, then return them (possibly an empty list).
+        """
+        while True:
+            r, w, x = select.select([self.Socket], [], [], timeout)
+            if not r:
+                return []
+            events = self.Read()
+            if events or (timeout is not None):
+                return events
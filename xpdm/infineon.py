@@ -3,12 +3,13 @@
 #
 
 import os
-import gtk
-import ctypes
 import math
 import serial
 from fnmatch import fnmatch
-from xpdm import FNENC
+from bisect import bisect_right
+from functools import reduce
+from operator import xor
+from xpdm import FNENC, serialpool, transport
 
 # Parameter widget types for editing
 PWT_COMBOBOX = 0
@@ -18,28 +19,370 @@ PWT_CHECKBOX = 2
 # Capabilities bitflags
 CAP_DOWNLOAD = 1
 
+# How many times to ask for the settings when verifying an upload
+VERIFY_QUERIES = 10
+
 # A list of controller families
 Families = []
 
+# Format detection confidence levels, see RankFamilies()
+FMT_PROBED = 1
+FMT_GENERIC = 2
+FMT_TAGGED = 3
+
+# Profile format detection index: tag line -> tag prefix -> families
+FormatTags = {}
+
 def log2(x):
     n = 0
     while (1 << n) < x:
         n += 1
     return n
 
+class ConversionTable:
+    """Precomputed raw <-> display conversion for one controller model.
+    Raw values are always 0..255, so the display values are tabulated
+    once; the reverse conversion picks the raw value with the nearest
+    display value, so that raw -> display -> raw always round-trips.
+    A value exactly halfway between two display values goes to the raw
+    value the model's Display2Raw formula rounds it to, as it did before
+    the tables. Display values more than half a step outside the table
+    map to -1 or 256, which are rejected like any other out of range
+    raw byte.
+    """
+
+    def __init__(self, Raw2Display, Display2Raw=None):
+        self.Raw2Display = Raw2Display
+        self.Display = [Raw2Display(r) for r in range(256)]
+        # Sorted display values and the thresholds halfway between them;
+        # the thresholds are rounded so that round display values which
+        # are ties compare equal to them
+        raws = sorted(range(256), key=lambda r: self.Display[r])
+        keys = [round((self.Display[a] + self.Display[b]) / 2, 9)
+                for a, b in zip(raws, raws[1:])]
+        if Display2Raw is not None:
+            for i, (a, key) in enumerate(zip(raws, keys)):
+                # A value equal to the threshold goes to the upper raw value,
+                # unless the threshold is just above it
+                if round(Display2Raw(key)) == a:
+                    keys[i] = math.nextafter(key, math.inf)
+        lo = 2 * self.Display[raws[0]] - keys[0]
+        hi = 2 * self.Display[raws[-1]] - keys[-1]
+        self.Raws = [-1] + raws + [256]
+        self.Keys = [lo] + keys + [hi]
+
+    def ToDisplay(self, raw):
+        r = int(raw)
+        if (r == raw) and (r >= 0) and (r <= 255):
+            return self.Display[r]
+        return self.Raw2Display(raw)
+
+    def ToRaw(self, val):
+        return self.Raws[bisect_right(self.Keys, val)]
+
+def CompileConversions(Parameters, ModelDesc):
+    """Build the conversion tables for every model and fill in the display
+    functions of the parameters which use them (the "Conversion" key names
+    a Raw2<name> conversion from ControllerModelDesc; its <name>2Raw
+    formula breaks ties).
+    """
+    for desc in ModelDesc:
+        desc["Tables"] = {}
+        for key, func in list(desc.items()):
+            if key.startswith("Raw2"):
+                desc["Tables"][key[4:]] = ConversionTable(func, desc.get(key[4:] + "2Raw"))
+
+    for parm, desc in Parameters.items():
+        if "Conversion" in desc:
+            conv = desc["Conversion"]
+            desc.setdefault("GetDisplay",
+                lambda prof, v, conv=conv: prof.GetController()["Tables"][conv].ToDisplay(v))
+            desc.setdefault("SetDisplay",
+                lambda prof, v, conv=conv: prof.GetController()["Tables"][conv].ToRaw(v))
+
+class RawCodec:
+    """The raw binary image layout of a controller family, compiled once
+    from the ParamRawOrder list so that encoding and decoding a profile
+    is a single pass over a flat table of (offset, parameter, converter).
+    """
+
+    def __init__(self, RawOrder, Parameters, ModelDesc):
+        # Image length, including the trailing XOR checksum byte
+        self.Length = len(RawOrder) + 1
+        # Constant bytes are stored once in the template buffer
+        self.Template = bytearray(self.Length)
+        self.Encoders = []
+        self.Decoders = []
+        self.ModelOffset = None
+
+        for idx, x in enumerate(RawOrder):
+            if type(x) != str:
+                self.Template[idx] = x
+                continue
+
+            desc = Parameters[x]
+            conv = desc.get("Conversion")
+            if "ToRaw" in desc:
+                enc = desc["ToRaw"]
+                conv = None
+            elif desc.get("Widget") == PWT_COMBOBOX:
+                enc = lambda prof, v: round(v)
+            elif desc.get("Widget") == PWT_SPINBUTTON:
+                enc = desc["SetDisplay"]
+            else:
+                enc = lambda prof, v: v
+            self.Encoders.append((idx, x, enc, conv))
+
+            # The controller model is decoded separately, before anything else
+            if x == "ControllerModel":
+                self.ModelOffset = idx
+                continue
+
+            if "FromRaw" in desc:
+                dec = desc["FromRaw"]
+                conv = None
+            elif desc.get("Widget") == PWT_SPINBUTTON:
+                dec = desc["GetDisplay"]
+            else:
+                dec = None
+                conv = None
+            self.Decoders.append((idx, x, dec, conv))
+
+        # temporary hack until someone finds out what means the 23rd byte
+        self.Byte23 = [y.get("Byte23") for y in ModelDesc]
+        self.ModelDesc = ModelDesc
+
+    def Encode(self, prof, data=None):
+        if data is None:
+            data = bytearray(self.Template)
+        else:
+            data[:] = self.Template
+
+        tables = prof.GetController()["Tables"]
+        for idx, parm, enc, conv in self.Encoders:
+            if conv is None:
+                data[idx] = int(enc(prof, getattr(prof, parm)))
+            else:
+                data[idx] = tables[conv].ToRaw(getattr(prof, parm))
+
+        b23 = self.Byte23[prof.ControllerModel - 1]
+        if b23 is not None:
+            data[23] = b23
+
+        # the checksum slot in the template is zero, so it does not affect the XOR
+        data[-1] = reduce(xor, data)
+        return data
+
+    def Decode(self, prof, data, name_wildcard):
+        if len(data) < self.Length:
+            raise ValueError(_("Broken data received (wrong family?)"))
+        if len(data) > self.Length:
+            # ignore trailing garbage
+            del data[self.Length:]
+
+        if reduce(xor, data, 0) != 0:
+            raise ValueError(_("Broken data received (wrong family?)"))
+
+        if self.ModelOffset is None:
+            raise ValueError(_("Controller model is not stored in raw data"))
+
+        # first of all, determine controller model
+        x = data[self.ModelOffset]
+        for n in range(len(self.ModelDesc)):
+            y = self.ModelDesc[n]
+            if (y["ControllerModel"] == x) and \
+                ((name_wildcard is None) or (fnmatch(y["Name"], name_wildcard))):
+                setattr(prof, "ControllerModel", n + 1)
+                break
+
+        if getattr(prof, "ControllerModel", None) is None:
+            return False
+
+        tables = prof.GetController()["Tables"]
+        for idx, parm, dec, conv in self.Decoders:
+            if conv is not None:
+                setattr(prof, parm, tables[conv].Display[data[idx]])
+            elif dec is None:
+                setattr(prof, parm, data[idx])
+            else:
+                setattr(prof, parm, dec(prof, data[idx]))
+
+        return True
+
+    def Compare(self, data, other):
+        """Return a list of (offset, parameter) for the bytes which differ
+        in two images, parameter being None for the bytes which are not
+        a parameter (the checksum byte is not compared)
+        """
+        parms = dict((idx, parm) for idx, parm, enc, conv in self.Encoders)
+        return [(idx, parms.get(idx)) for idx in range(self.Length - 1)
+                if data[idx] != other[idx]]
+
+class BitFieldParameter:
+    """Data descriptor for a controller parameter packed into some bits
+    of another (BitField) parameter.
+    """
+    __slots__ = ("Name", "Field", "Mask", "Shift")
+
+    def __init__(self, Name, Field, Mask, Shift):
+        self.Name = Name
+        # The slot descriptor of the storage parameter, set by CompileParameters()
+        self.Field = Field
+        self.Mask = Mask
+        self.Shift = Shift
+
+    def __get__(self, prof, cls):
+        if prof is None:
+            return self
+        return (self.Field.__get__(prof, cls) & self.Mask) >> self.Shift
+
+    def __set__(self, prof, val):
+        try:
+            old = self.Field.__get__(prof, type(prof))
+        except AttributeError:
+            old = 0
+        self.Field.__set__(prof, (old & ~self.Mask) | ((val << self.Shift) & self.Mask))
+
+def CompileParameters(ProfileClass, Parameters):
+    """Generate a subclass of ProfileClass which keeps every controller
+    parameter in a slot, with BitField members mapped onto the bits of
+    their storage slot. Unset parameters raise AttributeError as usual.
+    """
+    slots = tuple(parm for parm, desc in Parameters.items() if "BitField" not in desc)
+    attrs = {"__slots__": slots}
+    for parm, desc in Parameters.items():
+        if "BitField" in desc:
+            attrs[parm] = BitFieldParameter(parm, None, desc["BitMask"], desc["BitShift"])
+
+    cls = type(ProfileClass.__name__, (ProfileClass,), attrs)
+    cls.__module__ = ProfileClass.__module__
+    for parm, desc in Parameters.items():
+        if "BitField" in desc:
+            cls.__dict__[parm].Field = cls.__dict__[desc["BitField"]]
+
+    return cls
+
+def CompileDependents(Parameters):
+    """Invert the "Depends" lists of the parameters: return a dict mapping
+    a parameter to the tuple of parameters whose values or displayed values
+    depend on it, directly or through another parameter
+    """
+    direct = {}
+    for parm, desc in Parameters.items():
+        for dep in desc.get("Depends", ()):
+            direct.setdefault(dep, []).append(parm)
+
+    res = {}
+    for parm in direct:
+        deps = []
+        todo = list(direct[parm])
+        while todo:
+            dep = todo.pop(0)
+            if (dep != parm) and (dep not in deps):
+                deps.append(dep)
+                todo.extend(direct.get(dep, ()))
+        res[parm] = tuple(deps)
+    return res
+
+class VerifyError(Exception):
+    """The settings read back from the controller differ from the uploaded
+    ones. Mismatches is a list of (parameter, uploaded value, value read
+    back); bytes which are not a parameter are named by their offset.
+    """
+
+    def __init__(self, Mismatches):
+        self.Mismatches = Mismatches
+        Exception.__init__(self, _("Settings read back differ: %(parms)s") %
+                           {"parms": ", ".join(m[0] for m in Mismatches)})
+
 class ControllerFamily:
-    def __init__(self, Family, ProfileClass, DetectFormat, Capabilities, ModelDesc):
+    def __init__(self, Family, ProfileClass, DetectFormat, Capabilities, ModelDesc,
+                 Parameters, FormatTag=None):
+        # Generate parameter accessors, conversion tables and compile
+        # the raw image layout once for all profiles of this family
+        CompileConversions(Parameters, ModelDesc)
+        ProfileClass = CompileParameters(ProfileClass, Parameters)
+        ProfileClass.Codec = RawCodec(ProfileClass.ParamRawOrder, Parameters, ModelDesc)
+        ProfileClass.Dependents = CompileDependents(Parameters)
+
         def CreateProfile(FileName):
             return ProfileClass(Family, FileName)
 
         self.Family = Family
         self.CreateProfile = CreateProfile
         self.ModelDesc = ModelDesc
+        self.Parameters = Parameters
         self.DetectFormat = DetectFormat
+        # (minimal line count, tag line, tag prefix) of the .asv format
+        self.FormatTag = FormatTag
         self.Capabilities = Capabilities
-
-def RegisterFamily(Family, ProfileClass, DetectFormat, Capabilities, ModelDesc):
-    Families.append(ControllerFamily(Family, ProfileClass, DetectFormat, Capabilities, ModelDesc))
+        self.ProfileClass = ProfileClass
+        self.Codec = ProfileClass.Codec
+        self.Dependents = ProfileClass.Dependents
+
+def RegisterFamily(Family, ProfileClass, DetectFormat, Capabilities, ModelDesc, Parameters,
+                   FormatTag=None):
+    fam = ControllerFamily(Family, ProfileClass, DetectFormat, Capabilities,
+                           ModelDesc, Parameters, FormatTag)
+    Families.append(fam)
+
+    if (FormatTag is not None) and (FormatTag[1] is not None):
+        minl, line, prefix = FormatTag
+        FormatTags.setdefault(line, {}).setdefault(prefix, []).append(fam)
+
+def RankFamilies(lines):
+    """Return a list of (confidence, family) for all families the lines
+    of a .asv file could belong to, the most likely family first. Files
+    tagged with the model name (e.g. "3:EB212") are matched by tag, in a
+    single lookup per tag line; families without a tag come next if the
+    file is long enough, and families which only have a DetectFormat
+    function are probed last.
+    """
+    res = []
+    for line, prefixes in FormatTags.items():
+        if line >= len(lines):
+            continue
+        l = lines[line]
+        i = l.find(':')
+        if i < 0:
+            continue
+        tag = l[i + 1:].strip()
+        for prefix, fams in prefixes.items():
+            if tag.startswith(prefix):
+                for fam in fams:
+                    if len(lines) >= fam.FormatTag[0]:
+                        res.append((FMT_TAGGED, fam))
+
+    for fam in Families:
+        if fam.FormatTag is None:
+            if fam.DetectFormat(lines):
+                res.append((FMT_PROBED, fam))
+        elif fam.FormatTag[1] is None:
+            if len(lines) >= fam.FormatTag[0]:
+                res.append((FMT_GENERIC, fam))
+
+    res.sort(key=lambda x: -x[0])
+    return res
+
+def DetectFamily(lines):
+    """Return the most likely family for the lines of a .asv file, or None"""
+    res = RankFamilies(lines)
+    if res:
+        return res[0][1]
+    return None
+
+def FindFamily(name):
+    """Find a family by its name or an unambiguous, case insensitive
+    prefix of it (e.g. "kh6"), returns None if there's no such family.
+    """
+    name = name.lower()
+    res = [fam for fam in Families if fam.Family.lower().startswith(name)]
+    for fam in res:
+        if fam.Family.lower() == name:
+            return fam
+    if len(res) == 1:
+        return res[0]
+    return None
 
 class Profile:
     Family = None
@@ -55,6 +398,16 @@ class Profile:
     # The order of parameters in raw binary data sent to controller
     ParamRawOrder = []
 
+    # The compiled ParamRawOrder, filled in by RegisterFamily()
+    Codec = None
+
+    # Parameters depending on every parameter, filled in by RegisterFamily()
+    Dependents = {}
+
+    # Upload with read back, for families which support reading
+    UploadVerify = None
+    UploadVerifyAsync = None
+
     def __init__(self, Family, FileName, ControllerModelDesc, ControllerParameters):
         self.ControllerModelDesc = ControllerModelDesc
         self.ControllerParameters = ControllerParameters
@@ -64,32 +417,6 @@ class Profile:
             if "Default" in desc:
                 setattr(self, parm, desc["Default"])
 
-    def __setattr__(self, attr, val):
-        if "ControllerParameters" in self.__dict__:
-            if attr in self.ControllerParameters:
-                parmdesc = self.ControllerParameters[attr]
-                if "BitField" in parmdesc:
-                    if parmdesc["BitField"] in self.__dict__:
-                        self.__dict__[parmdesc["BitField"]] = \
-                            (self.__dict__[parmdesc["BitField"]] & ~parmdesc["BitMask"]) | \
-                            ((val << parmdesc["BitShift"]) & parmdesc["BitMask"])
-                    else:
-                        self.__dict__[parmdesc["BitField"]] = \
-                            (val << parmdesc["BitShift"]) & parmdesc["BitMask"]
-                    return
-
-        self.__dict__[attr] = val
-
-    def __getattr__(self, attr):
-        if "ControllerParameters" in self.__dict__:
-            if attr in self.ControllerParameters:
-                parmdesc = self.ControllerParameters[attr]
-                if "BitField" in parmdesc:
-                    return (self.__dict__[parmdesc["BitField"]] & parmdesc["BitMask"]) >> \
-                        parmdesc["BitShift"]
-
-        raise AttributeError("%r object has no attribute %r" % (self.__class__, attr))
-
     def SetFileName(self, fn, rename=True):
         sext = os.path.splitext(os.path.basename(fn))
         if sext[1].lower() != ".asv":
@@ -149,7 +476,8 @@ class Profile:
                             model = model[:model.find('/')]
                         lines.append("%d:%s" % (getattr(self, parm), model))
                     else:
-                        lines.append("%d" % getattr(self, parm))
+                        # Converted values may come out fractional, don't truncate them
+                        lines.append("%d" % round(getattr(self, parm)))
                 elif 'f' in desc["Type"]:
                     mask = "%%.%df" % desc.get("Precision", 1)
                     lines.append(mask % getattr(self, parm))
@@ -172,196 +500,54 @@ class Profile:
 
         return "???"
 
+    def GetDependents(self, parm):
+        """Return the parameters which need to be recomputed or displayed
+        again when parm changes
+        """
+        return self.Dependents.get(parm, ())
+
     def Remove(self):
         if self.FileName:
             os.remove(self.FileName)
 
-    def FillParameters(self, vbox):
-        rowcidx = 0
-        rowcolors = [gtk.gdk.Color(1.0, 1.0, 1.0), gtk.gdk.Color(1.0, 0.94, 0.86)]
-
-        self.EditWidgets = {}
-
-        for parm in self.ParamEditOrder:
-            if type(parm) == list:
-                if len(parm) > 0:
-                    expd = gtk.Expander(parm[0])
-                    expd.set_expanded(True)
-                    expd.set_border_width(1)
-                    expd.set_spacing(3)
-                    expd_vbox = gtk.VBox(False, 1)
-                    expd.add(expd_vbox)
-                    vbox.pack_start(expd, False, True, 0)
-                else:
-                    expd_vbox = gtk.VBox(False, 1)
-                    vbox.pack_start(expd_vbox, False, True, 0)
-                continue
-
-            desc = self.ControllerParameters[parm]
-
-            # Place the hbox in a event box to be able to change background color
-            evbox = gtk.EventBox()
-            hbox = gtk.HBox(False, 5)
-            hbox.set_border_width(2)
-            evbox.add(hbox)
-            evbox.set_tooltip_text(desc["Description"])
-            expd_vbox.pack_start(evbox, False, True, 0)
-
-            label = gtk.Label(desc["Name"])
-            label.set_alignment(0.0, 0.5)
-
-            evbox.modify_bg(gtk.STATE_NORMAL, rowcolors[rowcidx])
-            rowcidx ^= 1
-            hbox.pack_start(label, True, True, 0)
-
-            if desc["Widget"] == PWT_COMBOBOX:
-                minv, maxv = desc["Range"]
-                cb = gtk.combo_box_new_text()
-                for i in range(minv, maxv + 1):
-                    cb.append_text(desc["GetDisplay"](self, i))
-                cb.set_active(getattr(self, parm) - minv)
-                hbox.pack_start(cb, False, True, 0)
-                cb.connect("changed", self.ComboBoxChangeValue, parm, desc)
-                self.EditWidgets[parm] = cb
-
-            elif desc["Widget"] == PWT_SPINBUTTON:
-                minv, maxv = desc["Range"]
-                spin = gtk.SpinButton(climb_rate=1.0)
-                try:
-                    val = desc["SetDisplay"](self, getattr(self, parm))
-                except IndexError:
-                    val = desc["Default"]
-                spin.get_adjustment().configure(val, minv, maxv, 1, 5, 0)
-                spin.set_width_chars(7)
-                hbox.pack_start(spin, False, True, 0)
-                spin.connect("output", self.SpinButtonOutput, parm, desc)
-                spin.connect("input", self.SpinButtonInput, parm, desc)
-                spin.connect("value-changed", self.SpinButtonValueChanged, parm, desc)
-                self.EditWidgets[parm] = spin
-
-            elif desc["Widget"] == PWT_CHECKBOX:
-                cbut = gtk.CheckButton()
-                cbut.set_active(getattr(self, parm))
-                hbox.pack_start(cbut, False, True, 0)
-                cbut.connect("toggled", self.CheckButToggled, parm, desc)
-                self.EditWidgets[parm] = cbut
-
-        vbox.show_all()
-
-    def ComboBoxChangeValue(self, cb, parm, desc):
-        minv, maxv = desc["Range"]
-        setattr(self, parm, minv + cb.get_active())
-        # Check if any depending controls needs updating
-        for iparm, idesc in self.ControllerParameters.items():
-            if "Depends" in idesc:
-                if parm in idesc["Depends"]:
-                    self.EditWidgets[iparm].update()
-
-    def SpinButtonOutput(self, spin, parm, desc):
-        desc = self.ControllerParameters[parm]
-        if desc.get("Units") is None:
-            mask = "%%.%df" % desc.get("Precision", 1)
-        else:
-            mask = "%%.%df %s" % (desc.get("Precision", 1), desc.get("Units", "").replace('%', '%%'))
-        spin.set_text(mask % desc["GetDisplay"](self, spin.props.adjustment.value))
-        return True
-
-    # gptr hack, see http://www.mail-archive.com/pygtk@daa.com.au/msg16384.html
-    def SpinButtonInput(self, spin, gptr, parm, desc):
-        text = spin.get_text().strip()
-        if "Units" in desc:
-            try:
-                text = text[:text.rindex(desc["Units"])]
-            except ValueError:
-                pass
-        try:
-            val = float(desc["SetDisplay"](self, float(text.strip())))
-        except ValueError:
-            val = spin.props.adjustment.value
-
-        double = ctypes.c_double.from_address(hash(gptr))
-        double.value = val
-        return True
-
-    # don't allow the displayed value to go below zero
-    def SpinButtonValueChanged(self, spin, parm, desc):
-        while desc["GetDisplay"](self, spin.props.adjustment.value) < 0:
-            spin.props.adjustment.value += 1
-        val = desc["GetDisplay"](self, spin.props.adjustment.value)
-        prec = desc.get("Precision", 1)
-        val = round(val * math.pow(10, prec)) / math.pow(10, prec)
-        setattr(self, parm, val)
-
-    def CheckButToggled(self, cbut, parm, desc):
-        val = cbut.get_active()
-        if val:
-            val = 1
-        else:
-            val = 0
-        setattr(self, parm, val)
-
     def BuildRaw(self):
-        data = bytearray()
-
-        for x in self.ParamRawOrder:
-            if type(x) == str:
-                if "ToRaw" in self.ControllerParameters[x]:
-                    x = self.ControllerParameters[x]["ToRaw"](self, getattr(self, x))
-                elif self.ControllerParameters[x]["Widget"] == PWT_COMBOBOX:
-                    x = round(getattr(self, x))
-                elif self.ControllerParameters[x]["Widget"] == PWT_SPINBUTTON:
-                    x = self.ControllerParameters[x]["SetDisplay"](self, getattr(self, x))
-
-            data.append(int(x))
-
-        # temporary hack until someone finds out what means the 23rd byte
-        if "Byte23" in self.ControllerModelDesc[self.ControllerModel - 1]:
-            data[23] = self.ControllerModelDesc[self.ControllerModel - 1]["Byte23"]
-
-        crc = 0
-        for x in data:
-            crc = crc ^ x
-        data.append(crc)
-
-        return data
+        return self.Codec.Encode(self)
 
     def LoadRaw(self, data, name_wildcard):
-        data_len = len(self.ParamRawOrder) + 1
-        if len(data) > data_len:
-            # ignore trailing garbage
-            del data[data_len:]
-
-        crc = 0
-        for x in data:
-            crc = crc ^ x
-        if crc != 0:
-            raise ValueError(_("Broken data received (wrong family?)"))
-
-        # first of all, determine controller model
-        x = data[self.ParamRawOrder.index("ControllerModel")]
-        for n in range(len(self.ControllerModelDesc)):
-            y = self.ControllerModelDesc[n]
-            if (y["ControllerModel"] == x) and \
-                ((name_wildcard is None) or (fnmatch(y["Name"], name_wildcard))):
-                setattr(self, "ControllerModel", n + 1)
-                break
-
-        if getattr(self, "ControllerModel", None) is None:
-            return False
-
-        idx = 0
-        for x in self.ParamRawOrder:
-            if (type(x) == str) and (x != "ControllerModel"):
-                p = data[idx]
-                if "FromRaw" in self.ControllerParameters[x]:
-                        p = self.ControllerParameters[x]["FromRaw"](self, p)
-                elif self.ControllerParameters[x]["Widget"] == PWT_SPINBUTTON:
-                    p = self.ControllerParameters[x]["GetDisplay"](self, p)
-                setattr(self, x, p)
-
-            idx += 1
-
-        return True
+        return self.Codec.Decode(self, data, name_wildcard)
+
+    def CanVerify(self):
+        """Return True if uploads of this profile can be read back"""
+        fam = FindFamily(self.Family)
+        return (self.UploadVerify is not None) and (fam is not None) and \
+            bool(fam.Capabilities & CAP_DOWNLOAD)
+
+    def VerifyRaw(self, data, back):
+        """Compare the image read back from the controller with the uploaded
+        one, raises VerifyError if they differ
+        """
+        diff = self.Codec.Compare(data, back)
+        if not diff:
+            return True
+
+        # Decode the image read back to report values the user knows; other
+        # models may share the raw model code, so use the uploaded one
+        other = type(self)(self.Family, self.Description)
+        try:
+            decoded = other.LoadRaw(bytearray(back), self.GetModel())
+        except ValueError:
+            # A byte the parameter can't have, report the raw bytes
+            decoded = False
+        mismatches = []
+        for idx, parm in diff:
+            if parm is None:
+                mismatches.append(("#%d" % idx, data[idx], back[idx]))
+            elif not decoded:
+                mismatches.append((parm, _("raw %(val)d") % {"val": data[idx]},
+                                   _("raw %(val)d") % {"val": back[idx]}))
+            else:
+                mismatches.append((parm, getattr(self, parm), getattr(other, parm)))
+        raise VerifyError(mismatches)
 
     def CopyParameters(self, other):
         for parm in self.ControllerParameters.keys():
@@ -375,92 +561,22 @@ class Profile:
                 setattr(self, parm, val)
 
     def OpenSerial_EB3xx_KH6xx(self, com_port):
-        try:
-            return serial.Serial(com_port, 38400, serial.EIGHTBITS, serial.PARITY_NONE,
-                serial.STOPBITS_TWO, timeout=0.2)
-        except serial.SerialException as e:
-            raise serial.SerialException(str(e).encode(locale.getpreferredencoding()))
+        return serialpool.Pool.Open(com_port, 38400, serial.EIGHTBITS, serial.PARITY_NONE,
+            serial.STOPBITS_TWO, 0.2)
 
-    # Common code for EB3xx and KH6xx
+    # Common code for EB3xx and KH6xx; the protocols are implemented once
+    # in xpdm.transport, the synchronous versions block on the serial port
     def Upload_EB3xx_KH6xx(self, com_port, progress_func):
-        data = self.BuildRaw()
-        ser = self.OpenSerial(com_port)
-
-        progress_func(msg=_("Waiting for controller ready"))
-        # Send '8's and wait for the 'U' response
-        skip_write = False
-        while True:
-            if not skip_write:
-                # Garbage often comes from the controller upon bootup, just ignore it
-                ser.flushInput()
-                ser.write(b'8')
-            skip_write = False
-
-            c = ser.read()
-            if c == b'U':
-                break
-
-            if len(c) > 0:
-                skip_write = True
-
-            if not progress_func():
-                return False
-
-        progress_func(msg=_("Waiting acknowledgement"))
-
-        ser.flushInput()
-        ser.write(bytes(data))
-        ack = b"QR"
-        for i in range(10):
-            c = ser.read()
-            while len(c) and (c[0] == ack[0]):
-                c = c[1:]
-                ack = ack[1:]
-                if len(ack) == 0:
-                    return True
-
-            if len(c) > 0:
-                if c[0] == 0xa1:
-                    raise Exception(_("Controller says data is short (wrong family?)"))
-                elif c[0] == 0xa2:
-                    raise Exception(_("Controller says received data is broken"))
-                raise Exception(_("Invalid reply byte '%(chr)02x'") % {"chr": ord(c[0])})
-
-            if not progress_func():
-                break
-
-        raise Exception(_("Controller does not acknowledge data"))
+        return transport.RunSync(transport.Upload_EB3xx_KH6xx(
+            self, com_port, progress_func, transport.OpenBlocking))
 
     def Download_EB3xx_KH6xx(self, com_port, progress_func, name_wildcard):
-        data_len = len(self.ParamRawOrder) + 1
-
-        ser = self.OpenSerial(com_port)
-
-        progress_func(msg=_("Waiting for controller ready"))
-        # Send 'U' and wait for response
-        data = bytearray()
-        query = False
-        while True:
-            if query and len(data) == 0:
-                ser.flushInput()
-                ser.write(b'U')
-                query = False
-
-            c = ser.read()
-            if len(c) == 0:
-                if len(data) >= data_len:
-                    break
-                query = True
-                del data[:]
-                if not progress_func():
-                    return False
-            else:
-                for i in range(len(c)):
-                    data.append(ord(c[i]))
-                if not progress_func(pos=(float(len(data)) / data_len)):
-                    return False
-                # just in case
-                if len(data) >= 1024:
-                    break
-
-        return self.LoadRaw(data, name_wildcard)
+        return transport.RunSync(transport.Download_EB3xx_KH6xx(
+            self, com_port, progress_func, name_wildcard, transport.OpenBlocking))
+
+    def UploadVerify_EB3xx_KH6xx(self, com_port, progress_func):
+        """Upload the profile and read it back in the same session; raises
+        VerifyError if the controller did not take the settings
+        """
+        return transport.RunSync(transport.UploadVerify_EB3xx_KH6xx(
+            self, com_port, progress_func, transport.OpenBlocking))
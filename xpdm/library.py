@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Profile library: loading profiles from disk and a persistent index
+# of the profile directories, so that only changed files are re-parsed
+#
+
+import os
+import glob
+import json
+import threading
+from xpdm import FNENC
+from xpdm import infineon
+
+# Bump this when the index file layout changes
+INDEX_VERSION = 1
+
+# Rows reported at once while scanning
+SCAN_BATCH = 50
+
+
+def DecodeFileName(fn):
+    """Profile file names are kept in the glib file name encoding"""
+    if isinstance(fn, bytes):
+        return fn.decode(FNENC)
+    return fn
+
+
+def LoadProfile(fn):
+    """Load a profile from a .asv file, returns None if the format is unknown"""
+    # Comments after the values may be in any encoding, they are ignored anyway
+    with open(fn, "r", encoding=FNENC, errors="replace") as f:
+        l = f.readlines()
+    fam = infineon.DetectFamily(l)
+    if fam is None:
+        return None
+
+    prof = fam.CreateProfile(fn)
+    prof.Load(fn, l)
+    return prof
+
+
+class ProfileIndex:
+    """A cache of (family, model, description) for every profile file,
+    keyed by the file path and validated by its mtime and size. The index
+    is kept in a JSON file; files which did not change since the last
+    scan are not parsed again. The index may be used from several threads.
+    """
+
+    def __init__(self, FileName):
+        self.FileName = FileName
+        self.Lock = threading.RLock()
+        self.Entries = {}
+        self.Dirty = False
+        self.Load()
+
+    def Load(self):
+        try:
+            with open(self.FileName, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return
+
+        if data.get("version") != INDEX_VERSION:
+            return
+
+        # Entries from families which are no longer known (or known by
+        # a different name, e.g. after a language change) are stale
+        families = set(x.Family for x in infineon.Families)
+        for fn, ent in data.get("profiles", {}).items():
+            if (ent.get("family") is None) or (ent["family"] in families):
+                self.Entries[fn] = ent
+
+    def Save(self):
+        with self.Lock:
+            if not self.Dirty:
+                return
+            entries = dict(self.Entries)
+            self.Dirty = False
+
+        tmp = self.FileName + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "profiles": entries}, f)
+            os.replace(tmp, self.FileName)
+        except IOError:
+            self.Dirty = True
+            raise
+
+    def Lookup(self, fn, st):
+        """Return the cached entry for a file if it is still up to date"""
+        with self.Lock:
+            ent = self.Entries.get(fn)
+        if (ent is not None) and (ent["mtime"] == st.st_mtime_ns) and \
+           (ent["size"] == st.st_size):
+            return ent
+        return None
+
+    def Update(self, fn):
+        """Re-parse a single profile file and return its entry. Raises
+        IOError if the file cannot be read; a malformed file may raise
+        ValueError, or any other exception from the family's parser.
+        """
+        try:
+            st = os.stat(fn)
+        except OSError:
+            self.Remove(fn)
+            raise
+
+        ent = self.Lookup(fn, st)
+        if ent is not None:
+            return ent
+        return self.Parse(fn, st)
+
+    def Parse(self, fn, st):
+        """Parse a profile file with the given stat result and cache its entry"""
+        self.Remove(fn)
+        # Parse outside the lock, the other threads may go on meanwhile
+        prof = LoadProfile(fn)
+
+        # Unknown formats are remembered too, to avoid parsing them again
+        ent = {"mtime": st.st_mtime_ns, "size": st.st_size,
+               "family": None, "model": None, "description": None}
+        if prof is not None:
+            ent["family"] = prof.Family
+            ent["model"] = prof.GetModel()
+            ent["description"] = prof.Description
+
+        with self.Lock:
+            self.Entries[fn] = ent
+            self.Dirty = True
+        return ent
+
+    def Remove(self, fn):
+        with self.Lock:
+            if self.Entries.pop(fn, None) is not None:
+                self.Dirty = True
+
+    def Scan(self, dirs, report=None, batch=SCAN_BATCH):
+        """Scan the profile directories, returning a list of
+        (family, model, description, file name) rows and a list of
+        (file name, error message) for the files that failed to load.
+        Only the files which changed since the last scan are parsed; if
+        report is given, report(rows, errors) is called with every batch
+        of results as they come in.
+        """
+        files = []
+        for d in dirs:
+            files.extend(glob.glob(os.path.join(d, "*.asv")))
+
+        rows = []
+        errors = []
+        brows = []
+        berrors = []
+        for fn in files:
+            try:
+                st = os.stat(fn)
+                ent = self.Lookup(fn, st)
+                if ent is None:
+                    ent = self.Parse(fn, st)
+            except IOError as e:
+                self.Remove(fn)
+                berrors.append((fn, str(e.strerror)))
+                ent = None
+            except ValueError as e:
+                berrors.append((fn, str(e)))
+                ent = None
+            except Exception as e:
+                # A malformed file must not abort the whole scan
+                berrors.append((fn, "%s: %s" % (type(e).__name__, e)))
+                ent = None
+
+            if (ent is not None) and (ent["family"] is not None):
+                brows.append((ent["family"], ent["model"], ent["description"], fn))
+
+            if len(brows) + len(berrors) >= batch:
+                if report is not None:
+                    report(brows, berrors)
+                rows.extend(brows)
+                errors.extend(berrors)
+                brows = []
+                berrors = []
+
+        if (report is not None) and (brows or berrors):
+            report(brows, berrors)
+        rows.extend(brows)
+        errors.extend(berrors)
+
+        # Forget files which disappeared from the scanned directories
+        seen = set(files)
+        dirs = set(os.path.normpath(d) for d in dirs)
+        with self.Lock:
+            for fn in list(self.Entries.keys()):
+                if (fn not in seen) and (os.path.dirname(os.path.normpath(fn)) in dirs):
+                    self.Remove(fn)
+
+        return rows, errors
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Progress reporting between the serial protocol code and the user interface
+#
+
+import time
+
+# Default progress display updates per second
+FRAME_RATE = 20
+
+
+class Throttle:
+    """A progress_func for Upload()/Download() and friends. The protocol
+    code calls it on every chunk and handshake probe; it checks for
+    cancellation and timeout every time, which is cheap, but passes the
+    progress on to Show() at most Rate times a second. Messages mark the
+    protocol steps and are shown right away, together with the latest
+    position.
+
+    Show(pos, msg) calls Report(pos, msg) by default; if that returns
+    False the transfer is cancelled. Stop() cancels it from any thread.
+    """
+
+    def __init__(self, Report=None, Rate=FRAME_RATE, Timeout=None):
+        self.Report = Report
+        self.Interval = 1.0 / Rate
+        self.Deadline = None
+        if Timeout is not None:
+            self.Deadline = time.monotonic() + Timeout
+        self.Next = 0.0
+        self.Pos = None
+        self.Cancelled = False
+        self.TimedOut = False
+
+    def __call__(self, pos=None, msg=None):
+        if self.Cancelled:
+            return False
+        if pos is not None:
+            self.Pos = pos
+
+        now = time.monotonic()
+        if (msg is not None) or (now >= self.Next):
+            self.Next = now + self.Interval
+            pos, self.Pos = self.Pos, None
+            if self.Show(pos, msg) is False:
+                self.Cancelled = True
+                return False
+
+        if (self.Deadline is not None) and (now > self.Deadline):
+            self.TimedOut = True
+            return False
+        return True
+
+    def Show(self, pos, msg):
+        if self.Report is not None:
+            return self.Report(pos, msg)
+        return True
+
+    def Stop(self):
+        self.Cancelled = True
@@ -9,13 +9,18 @@ Part of pySerial (http://pyserial.sf.net)
 import serial
 import glob
 
+# Common Unix USB serial device names
+PORT_PATTERNS = ('/dev/ttyUSB*', '/dev/tty.usbserial*')
+
 def comports(available_only=True):
     """This generator scans the device directory for com ports and yields
     (order, port, desc, hwid).  available_only is ignored for Windows compatibility,
     Order is a helper to get sorted lists. it can be ignored otherwise."""
     order = 1
-    # Common Unix USB serial device names
-    for port in sorted(glob.glob('/dev/ttyUSB*') + glob.glob('/dev/tty.usbserial*')):
+    ports = []
+    for pattern in PORT_PATTERNS:
+        ports += glob.glob(pattern)
+    for port in sorted(ports):
         # this would give wrong results on opened com ports
         #if available_only:
         #    try:
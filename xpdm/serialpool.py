@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Pool of open serial ports, reused across uploads and downloads
+#
+
+import os
+import time
+import threading
+import serial
+
+# Close ports which were not used for this long, seconds
+IDLE_TIMEOUT = 10.0
+
+
+class Session:
+    """An open serial port handed out by the pool. It behaves like the
+    serial.Serial object it wraps, except that close() returns the port
+    to the pool rather than closing it. Transferred bytes are counted.
+    """
+
+    def __init__(self, Pool, Key, Serial):
+        self.Pool = Pool
+        self.Key = Key
+        self.Serial = Serial
+        self.InUse = False
+        self.Broken = False
+        self.LastUsed = 0.0
+        self.BytesIn = 0
+        self.BytesOut = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        # Everything not counted goes straight to the port
+        return getattr(self.Serial, name)
+
+    @property
+    def timeout(self):
+        return self.Serial.timeout
+
+    @timeout.setter
+    def timeout(self, val):
+        if self.Serial.timeout != val:
+            self.Serial.timeout = val
+
+    def Count(self, nin, nout):
+        self.BytesIn += nin
+        self.BytesOut += nout
+        self.Pool.Count(nin, nout)
+
+    def read(self, size=1):
+        try:
+            data = self.Serial.read(size)
+        except (serial.SerialException, OSError):
+            self.Broken = True
+            raise
+        self.Count(len(data), 0)
+        return data
+
+    def readinto(self, buf):
+        try:
+            n = self.Serial.readinto(buf)
+        except (serial.SerialException, OSError):
+            self.Broken = True
+            raise
+        self.Count(n, 0)
+        return n
+
+    def Received(self, data):
+        """Note data read straight from the file descriptor"""
+        self.Count(len(data), 0)
+
+    def write(self, data):
+        try:
+            n = self.Serial.write(data)
+        except (serial.SerialException, OSError):
+            self.Broken = True
+            raise
+        self.Count(0, len(data))
+        return n
+
+    def close(self):
+        self.Pool.Release(self)
+
+
+class SerialPool:
+    """Open serial ports keyed by (port, baud rate, byte size, parity,
+    stop bits). A port is kept open after an operation finishes, so the
+    next operation on the same cable with the same framing reuses it,
+    unless the device was unplugged since; ports idle for IdleTimeout
+    seconds are closed. Opening a port which is in use, or is open with
+    a different framing, closes the idle session first or fails if it
+    is busy.
+    """
+
+    def __init__(self, IdleTimeout=IDLE_TIMEOUT):
+        self.IdleTimeout = IdleTimeout
+        self.Lock = threading.Lock()
+        self.Sessions = {}
+        self.Timer = None
+        self.Counters = {"opened": 0, "reused": 0, "closed": 0,
+                         "bytes_in": 0, "bytes_out": 0}
+
+    def Count(self, nin, nout):
+        with self.Lock:
+            self.Counters["bytes_in"] += nin
+            self.Counters["bytes_out"] += nout
+
+    def Open(self, port, baudrate, bytesize, parity, stopbits, timeout):
+        key = (port, baudrate, bytesize, parity, stopbits)
+        with self.Lock:
+            for ses in list(self.Sessions.values()):
+                if ses.Key[0] != port:
+                    continue
+                if ses.InUse:
+                    raise serial.SerialException(_("Serial port %(port)s is busy") % {"port": port})
+                if ses.Key != key:
+                    self.Discard(ses)
+
+            ses = self.Sessions.get(key)
+            if (ses is not None) and not self.Alive(ses):
+                self.Discard(ses)
+                ses = None
+            if ses is not None:
+                self.Counters["reused"] += 1
+            else:
+                try:
+                    ser = serial.Serial(port, baudrate, bytesize, parity, stopbits,
+                                        timeout=timeout)
+                except serial.SerialException as e:
+                    raise serial.SerialException(str(e))
+                ses = Session(self, key, ser)
+                self.Sessions[key] = ses
+                self.Counters["opened"] += 1
+
+            ses.InUse = True
+
+        ses.timeout = timeout
+        return ses
+
+    def Alive(self, ses):
+        """Check that the port of an idle session is still the device it
+        was opened on; after a replug the device node is a new one
+        """
+        try:
+            fd = ses.Serial.fileno()
+        except (AttributeError, ValueError, serial.SerialException):
+            # Nothing to compare with (e.g. Windows)
+            return True
+        try:
+            st = os.stat(ses.Key[0])
+            fst = os.fstat(fd)
+        except OSError:
+            return False
+        return (st.st_rdev, st.st_ino) == (fst.st_rdev, fst.st_ino)
+
+    def Release(self, ses):
+        with self.Lock:
+            if not ses.InUse:
+                return
+            ses.InUse = False
+            if ses.Broken or (self.IdleTimeout <= 0):
+                self.Discard(ses)
+                return
+            ses.LastUsed = time.monotonic()
+            self.Schedule()
+
+    def Discard(self, ses):
+        # Called with the lock held
+        if self.Sessions.get(ses.Key) is ses:
+            del self.Sessions[ses.Key]
+        try:
+            ses.Serial.close()
+        except (serial.SerialException, OSError):
+            pass
+        self.Counters["closed"] += 1
+
+    def Schedule(self):
+        # Called with the lock held
+        if (self.Timer is None) and self.Sessions:
+            self.Timer = threading.Timer(self.IdleTimeout, self.CloseIdle)
+            self.Timer.daemon = True
+            self.Timer.start()
+
+    def CloseIdle(self):
+        """Close the ports which were not used for IdleTimeout seconds"""
+        now = time.monotonic()
+        with self.Lock:
+            self.Timer = None
+            for ses in list(self.Sessions.values()):
+                if (not ses.InUse) and (now - ses.LastUsed >= self.IdleTimeout):
+                    self.Discard(ses)
+            # Check again later for the ports still open
+            if any(not ses.InUse for ses in self.Sessions.values()):
+                self.Schedule()
+
+    def Close(self, port=None):
+        """Close the idle sessions on a port (e.g. when it was unplugged),
+        or on all ports; sessions in use are closed when released
+        """
+        with self.Lock:
+            for ses in list(self.Sessions.values()):
+                if (port is None) or (ses.Key[0] == port):
+                    if ses.InUse:
+                        ses.Broken = True
+                    else:
+                        self.Discard(ses)
+            if (port is None) and (self.Timer is not None):
+                self.Timer.cancel()
+                self.Timer = None
+
+    def Status(self):
+        """Return a list of (port, in use, bytes in, bytes out) for the
+        open sessions
+        """
+        with self.Lock:
+            return [(ses.Key[0], ses.InUse, ses.BytesIn, ses.BytesOut)
+                    for ses in self.Sessions.values()]
+
+
+# The serial ports of this process
+Pool = SerialPool()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Flashing station: uploading profiles to controllers on many serial
+# ports at once, e.g. at the end of a production line
+#
+
+import time
+import asyncio
+from xpdm import progress
+
+# Port job states
+PJS_IDLE = 0
+PJS_WAITING = 1
+PJS_UPLOADING = 2
+PJS_DONE = 3
+PJS_FAILED = 4
+PJS_STOPPED = 5
+
+# Delay before retrying a port after an error in repeat mode, seconds
+RETRY_DELAY = 1.0
+
+
+class PortJob:
+    """Uploading a profile through one serial port, and its statistics"""
+
+    def __init__(self, Port, Profile):
+        self.Port = Port
+        self.Profile = Profile
+        self.State = PJS_IDLE
+        self.Message = ""
+        self.Done = 0
+        self.Failed = 0
+        self.Future = None
+        self.Progress = None
+
+    def SetState(self, state, msg=None):
+        self.State = state
+        if msg is not None:
+            self.Message = msg
+
+
+class Station:
+    """Runs the uploads of a set of PortJob's concurrently on a
+    transport.SessionLoop. In Repeat mode every port waits for the next
+    controller after an upload finishes, until Stop() is called.
+
+    Changed(job) is called every time the state or message of a job
+    changes, and Stopped() once all jobs have finished; both are called
+    through the session loop dispatcher. With Verify, the settings are
+    read back after every upload to controllers which support it.
+    """
+
+    def __init__(self, Jobs, Loop, Changed, Stopped, Repeat=False, Verify=False):
+        self.Jobs = Jobs
+        self.Loop = Loop
+        self.Changed = Changed
+        self.Stopped = Stopped
+        self.Repeat = Repeat
+        self.Verify = Verify
+        self.Running = False
+        self.Active = 0
+        self.StartTime = None
+        self.StopTime = None
+
+    def Start(self):
+        self.Running = True
+        self.StartTime = time.monotonic()
+        self.StopTime = None
+        self.Active = len(self.Jobs)
+        for job in self.Jobs:
+            job.Future = self.Loop.Submit(self.Run(job),
+                lambda res, err, job=job: self.JobFinished(job, err))
+
+    def Stop(self):
+        # The uploads notice this the next time they report progress
+        self.Running = False
+        for job in self.Jobs:
+            if job.Progress is not None:
+                job.Progress.Stop()
+
+    def Notify(self, job):
+        self.Loop.Post(self.Changed, job)
+
+    def Progress(self, job, pos=None, msg=None):
+        if msg is not None:
+            # The handshake is over once the protocol moves on to the next step
+            if job.Message and (job.State == PJS_WAITING):
+                job.State = PJS_UPLOADING
+            job.Message = msg
+            self.Notify(job)
+        return self.Running
+
+    async def Run(self, job):
+        verify = self.Verify and job.Profile.CanVerify()
+        upload = job.Profile.UploadVerifyAsync if verify else job.Profile.UploadAsync
+        job.Progress = progress.Throttle(lambda pos, msg: self.Progress(job, pos, msg))
+        while self.Running:
+            job.SetState(PJS_WAITING, "")
+            self.Notify(job)
+            try:
+                ok = await upload(job.Port, job.Progress)
+            except Exception as e:
+                if not self.Running:
+                    # Stopped while waiting for the acknowledgement
+                    return
+                job.Failed += 1
+                job.SetState(PJS_FAILED, str(e))
+                self.Notify(job)
+                if not self.Repeat:
+                    return
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            if not ok:
+                return
+
+            job.Done += 1
+            if verify:
+                job.SetState(PJS_DONE, _("Settings uploaded and verified successfully"))
+            else:
+                job.SetState(PJS_DONE, _("Settings uploaded successfully"))
+            self.Notify(job)
+            if not self.Repeat:
+                return
+
+    def JobFinished(self, job, err):
+        if err is not None:
+            job.SetState(PJS_FAILED, str(err))
+            self.Changed(job)
+        elif job.State in (PJS_IDLE, PJS_WAITING, PJS_UPLOADING):
+            job.SetState(PJS_STOPPED, _("Upload cancelled"))
+            self.Changed(job)
+
+        self.Active -= 1
+        if self.Active == 0:
+            self.Running = False
+            self.StopTime = time.monotonic()
+            self.Stopped()
+
+    def Elapsed(self):
+        if self.StartTime is None:
+            return 0.0
+        return (self.StopTime or time.monotonic()) - self.StartTime
+
+    def Totals(self):
+        """Return the number of programmed and failed controllers"""
+        return sum(job.Done for job in self.Jobs), sum(job.Failed for job in self.Jobs)
+
+    def Throughput(self):
+        """Return the programmed controllers per hour since Start()"""
+        elapsed = self.Elapsed()
+        if elapsed <= 0:
+            return 0.0
+        return self.Totals()[0] * 3600.0 / elapsed
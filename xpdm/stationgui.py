@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Flashing station window: programs controllers on several ports at once
+#
+
+import gtk
+import glib
+from xpdm import comports, station
+
+# Station list store columns
+SC_ENABLED = 0
+SC_PORT = 1
+SC_PROFILE = 2
+SC_FILENAME = 3
+SC_STATUS = 4
+SC_DONE = 5
+SC_FAILED = 6
+
+
+class StationWindow:
+    """A window with a row for every serial port, each of which can be
+    given its own profile. Uploads run on all the enabled ports at once
+    through the application's session loop.
+    """
+
+    def __init__(self, parent, ProfileStore, LoadProfile, Sessions, FileName=None):
+        self.ProfileStore = ProfileStore
+        self.LoadProfile = LoadProfile
+        self.Sessions = Sessions
+        self.Station = None
+        self.Timer = None
+        self.CloseRequested = False
+
+        self.Window = gtk.Window()
+        self.Window.set_title(_("Flashing station"))
+        self.Window.set_transient_for(parent)
+        self.Window.set_default_size(640, 320)
+        self.Window.set_border_width(5)
+        self.Window.connect("delete-event", self.on_Window_delete_event)
+
+        vbox = gtk.VBox(False, 5)
+        self.Window.add(vbox)
+
+        self.Store = gtk.ListStore(bool, str, str, str, str, int, int)
+        self.Rows = {}
+        desc = ""
+        for row in ProfileStore:
+            if row[3] == FileName:
+                desc = row[2]
+        for order, port, pdesc, hwid in sorted(comports()):
+            self.Rows[port] = self.Store.append(
+                (FileName is not None, port, desc, FileName or "", "", 0, 0))
+
+        self.List = gtk.TreeView(self.Store)
+        cell = gtk.CellRendererToggle()
+        cell.connect("toggled", self.on_Enabled_toggled)
+        self.List.append_column(gtk.TreeViewColumn(_("Use"), cell, active=SC_ENABLED))
+        self.List.append_column(gtk.TreeViewColumn(_("Serial port"), gtk.CellRendererText(),
+                                                   text=SC_PORT))
+
+        cell = gtk.CellRendererCombo()
+        cell.set_property("model", ProfileStore)
+        cell.set_property("text-column", 2)
+        cell.set_property("has-entry", False)
+        cell.set_property("editable", True)
+        cell.connect("changed", self.on_Profile_changed)
+        column = gtk.TreeViewColumn(_("Profile"), cell, text=SC_PROFILE)
+        column.set_resizable(True)
+        column.set_min_width(150)
+        self.List.append_column(column)
+
+        column = gtk.TreeViewColumn(_("Status"), gtk.CellRendererText(), text=SC_STATUS)
+        column.set_expand(True)
+        self.List.append_column(column)
+        self.List.append_column(gtk.TreeViewColumn(_("Done"), gtk.CellRendererText(),
+                                                   text=SC_DONE))
+        self.List.append_column(gtk.TreeViewColumn(_("Failed"), gtk.CellRendererText(),
+                                                   text=SC_FAILED))
+
+        sw = gtk.ScrolledWindow()
+        sw.set_policy(gtk.POLICY_AUTOMATIC, gtk.POLICY_AUTOMATIC)
+        sw.add(self.List)
+        vbox.pack_start(sw, True, True, 0)
+
+        self.Summary = gtk.Label()
+        self.Summary.set_alignment(0.0, 0.5)
+        vbox.pack_start(self.Summary, False, True, 0)
+
+        hbox = gtk.HBox(False, 5)
+        vbox.pack_start(hbox, False, True, 0)
+        self.Repeat = gtk.CheckButton(_("Keep programming until stopped"))
+        self.Repeat.set_active(True)
+        hbox.pack_start(self.Repeat, False, True, 0)
+        self.Verify = gtk.CheckButton(_("Verify settings after upload"))
+        hbox.pack_start(self.Verify, False, True, 0)
+
+        but = gtk.Button(stock="gtk-close")
+        but.connect("clicked", self.on_ButtonClose_clicked)
+        hbox.pack_end(but, False, True, 0)
+        self.ButtonStart = gtk.Button(stock="gtk-execute")
+        self.ButtonStart.connect("clicked", self.on_ButtonStart_clicked)
+        hbox.pack_end(self.ButtonStart, False, True, 0)
+
+        self.UpdateSummary()
+        self.Window.show_all()
+
+    def UpdateSummary(self):
+        if self.Station is None:
+            self.Summary.set_text(_("Select the ports to use and their profiles, then press Execute"))
+            return True
+
+        done, failed = self.Station.Totals()
+        self.Summary.set_text(
+            _("Programmed: %(done)d, failed: %(failed)d, %(rate).1f controllers/hour") %
+            {"done": done, "failed": failed, "rate": self.Station.Throughput()})
+        return True
+
+    def Start(self):
+        jobs = []
+        profiles = {}
+        for row in self.Store:
+            if not (row[SC_ENABLED] and row[SC_FILENAME]):
+                continue
+            fn = row[SC_FILENAME]
+            if fn not in profiles:
+                try:
+                    profiles[fn] = self.LoadProfile(fn)
+                except (IOError, ValueError):
+                    profiles[fn] = None
+                if profiles[fn] is None:
+                    self.Summary.set_text(_("Failed to load profile %(fn)s") % {"fn": fn})
+                    return
+            jobs.append(station.PortJob(row[SC_PORT], profiles[fn]))
+            row[SC_DONE] = row[SC_FAILED] = 0
+            row[SC_STATUS] = ""
+
+        if not jobs:
+            self.Summary.set_text(_("No ports with a profile selected"))
+            return
+
+        self.Station = station.Station(jobs, self.Sessions, self.on_Job_changed,
+                                       self.on_Station_stopped, self.Repeat.get_active(),
+                                       self.Verify.get_active())
+        self.Station.Start()
+        self.ButtonStart.set_label("gtk-stop")
+        self.Repeat.set_sensitive(False)
+        self.Verify.set_sensitive(False)
+        self.Timer = glib.timeout_add_seconds(1, self.UpdateSummary)
+        self.UpdateSummary()
+
+    # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- # -- #
+
+    def on_Enabled_toggled(self, cell, path):
+        if self.Station is None or not self.Station.Running:
+            self.Store[path][SC_ENABLED] = not self.Store[path][SC_ENABLED]
+
+    def on_Profile_changed(self, cell, path, it):
+        self.Store[path][SC_PROFILE] = self.ProfileStore[it][2]
+        self.Store[path][SC_FILENAME] = self.ProfileStore[it][3]
+        self.Store[path][SC_ENABLED] = True
+
+    def on_Job_changed(self, job):
+        row = self.Store[self.Rows[job.Port]]
+        row[SC_STATUS] = job.Message
+        row[SC_DONE] = job.Done
+        row[SC_FAILED] = job.Failed
+
+    def on_Station_stopped(self):
+        if self.Timer is not None:
+            glib.source_remove(self.Timer)
+            self.Timer = None
+        self.UpdateSummary()
+        self.ButtonStart.set_label("gtk-execute")
+        self.ButtonStart.set_sensitive(True)
+        self.Repeat.set_sensitive(True)
+        self.Verify.set_sensitive(True)
+        if self.CloseRequested:
+            self.Window.destroy()
+
+    def on_ButtonStart_clicked(self, but):
+        if self.Station is not None and self.Station.Running:
+            self.Station.Stop()
+            self.ButtonStart.set_sensitive(False)
+        else:
+            self.Start()
+
+    def on_ButtonClose_clicked(self, but):
+        self.on_Window_delete_event(self.Window, None)
+
+    def on_Window_delete_event(self, win, event):
+        if self.Station is not None and self.Station.Running:
+            # Close once the uploads in progress have finished
+            self.CloseRequested = True
+            self.Station.Stop()
+            self.Window.hide()
+        else:
+            self.Window.destroy()
+        return True
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Serial protocol traces: recording every read and write of a session to
+# a compact binary file, analysing and replaying it
+#
+
+import time
+import struct
+
+# File header: magic, format version, wall clock time of the first event
+TRACE_MAGIC = b"XPDT"
+TRACE_VERSION = 1
+HEADER = struct.Struct("<4sBd")
+# Event header: microseconds since the previous event, kind, data length
+EVENT = struct.Struct("<IBH")
+
+# Event kinds
+EV_OPEN = 0
+EV_CLOSE = 1
+EV_WRITE = 2
+EV_READ = 3
+EV_FLUSH = 4
+EV_TIMEOUT = 5
+
+EventNames = {
+    EV_OPEN: "open",
+    EV_CLOSE: "close",
+    EV_WRITE: "write",
+    EV_READ: "read",
+    EV_FLUSH: "flush",
+    EV_TIMEOUT: "timeout",
+}
+
+
+class TraceError(Exception):
+    pass
+
+
+class TraceWriter:
+    """Appends events to a trace file. The file is flushed whenever a
+    read times out, so a trace of a stalled session is complete on disk
+    even if the program is killed.
+    """
+
+    def __init__(self, fn):
+        self.File = open(fn, "wb")
+        self.File.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, time.time()))
+        self.Last = time.monotonic()
+
+    def Event(self, kind, data=b""):
+        if self.File.closed:
+            # The profile outlived the recording
+            return
+        now = time.monotonic()
+        delta = min(0xffffffff, int((now - self.Last) * 1000000))
+        # Keep the fractions lost to rounding for the next event
+        self.Last += delta / 1000000.0
+        for i in range(0, max(1, len(data)), 0xffff):
+            chunk = data[i:i + 0xffff]
+            self.File.write(EVENT.pack(delta, kind, len(chunk)))
+            self.File.write(chunk)
+            delta = 0
+        if (kind == EV_READ) and not data:
+            self.File.flush()
+
+    def Close(self):
+        self.File.close()
+
+
+def Load(fn):
+    """Return the events of a trace file as a list of (time, kind, data),
+    time being seconds since the first event
+    """
+    with open(fn, "rb") as f:
+        buf = f.read()
+
+    if len(buf) < HEADER.size:
+        raise TraceError(_("Not a trace file: %(fn)s") % {"fn": fn})
+    magic, ver, wall = HEADER.unpack_from(buf)
+    if magic != TRACE_MAGIC or ver != TRACE_VERSION:
+        raise TraceError(_("Not a trace file: %(fn)s") % {"fn": fn})
+
+    events = []
+    t = None
+    ofs = HEADER.size
+    while ofs + EVENT.size <= len(buf):
+        delta, kind, n = EVENT.unpack_from(buf, ofs)
+        ofs += EVENT.size
+        t = 0.0 if t is None else t + delta / 1000000.0
+        # A trace cut short by a crash ends with a partial event
+        events.append((t, kind, buf[ofs:ofs + n]))
+        ofs += n
+    return events
+
+
+class Recorder:
+    """Wraps the serial port returned by a profile's OpenSerial() and logs
+    every operation on it to a TraceWriter
+    """
+
+    def __init__(self, ser, Writer, Port):
+        self.Serial = ser
+        self.Writer = Writer
+        Writer.Event(EV_OPEN, Port.encode("utf-8", "replace"))
+        Writer.Event(EV_TIMEOUT, struct.pack("<d", ser.timeout or 0.0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.Serial, name)
+
+    @property
+    def timeout(self):
+        return self.Serial.timeout
+
+    @timeout.setter
+    def timeout(self, val):
+        if self.Serial.timeout != val:
+            self.Writer.Event(EV_TIMEOUT, struct.pack("<d", val or 0.0))
+        self.Serial.timeout = val
+
+    @property
+    def Broken(self):
+        return self.Serial.Broken
+
+    @Broken.setter
+    def Broken(self, val):
+        self.Serial.Broken = val
+
+    def read(self, size=1):
+        data = self.Serial.read(size)
+        self.Writer.Event(EV_READ, data)
+        return data
+
+    def readinto(self, buf):
+        n = self.Serial.readinto(buf)
+        self.Writer.Event(EV_READ, bytes(buf[:n]))
+        return n
+
+    def Received(self, data):
+        self.Writer.Event(EV_READ, data)
+        self.Serial.Received(data)
+
+    def write(self, data):
+        n = self.Serial.write(data)
+        self.Writer.Event(EV_WRITE, bytes(data))
+        return n
+
+    def flushInput(self):
+        self.Serial.flushInput()
+        self.Writer.Event(EV_FLUSH)
+
+    def close(self):
+        self.Writer.Event(EV_CLOSE)
+        self.Serial.close()
+
+
+def Record(prof, fn):
+    """Log every port opened by the profile to the trace file fn; returns
+    the TraceWriter, which the caller closes when done
+    """
+    writer = TraceWriter(fn)
+    opener = prof.OpenSerial
+    prof.OpenSerial = lambda com_port: Recorder(opener(com_port), writer, com_port)
+    return writer
+
+
+class Replayer:
+    """A serial port which plays back the controller side of a trace at
+    full speed. Reads return the recorded data and writes consume the
+    recorded writes, so Upload() and Download() take the same path they
+    took when the trace was recorded. Writes which differ from the
+    recorded ones are counted in Mismatches.
+    """
+
+    def __init__(self, Events):
+        self.Events = [(kind, data) for t, kind, data in Events
+                       if kind in (EV_READ, EV_WRITE)]
+        self.Pos = 0
+        self.Buffer = bytearray()
+        self.Mismatches = 0
+        self.timeout = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def Next(self, kind):
+        if self.Pos < len(self.Events) and self.Events[self.Pos][0] == kind:
+            self.Pos += 1
+            return self.Events[self.Pos - 1][1]
+        return None
+
+    def read(self, size=1):
+        if not self.Buffer:
+            data = self.Next(EV_READ)
+            if data is None:
+                if self.Pos >= len(self.Events):
+                    raise TraceError(_("Trace ends here"))
+                # The host wrote next, so this read timed out
+                return b""
+            self.Buffer.extend(data)
+
+        data = bytes(self.Buffer[:size])
+        del self.Buffer[:size]
+        return data
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def inWaiting(self):
+        if not self.Buffer:
+            self.Buffer.extend(self.Next(EV_READ) or b"")
+        return len(self.Buffer)
+
+    def write(self, data):
+        # Received data skipped here was flushed or never read
+        while self.Pos < len(self.Events) and self.Events[self.Pos][0] != EV_WRITE:
+            self.Pos += 1
+        rec = self.Next(EV_WRITE)
+        if rec is None:
+            raise TraceError(_("Trace ends here"))
+        if rec != bytes(data):
+            self.Mismatches += 1
+        return len(data)
+
+    def flushInput(self):
+        del self.Buffer[:]
+
+    def close(self):
+        pass
+
+
+def Replay(prof, fn):
+    """Make the profile talk to a replay of the trace file fn instead of a
+    serial port; returns the Replayer
+    """
+    rep = Replayer(Load(fn))
+    prof.OpenSerial = lambda com_port: rep
+    return rep
+
+
+def Summary(events):
+    """Split a trace into protocol phases. Returns a dict with the total
+    session time, the handshake, transfer and acknowledgement wait times
+    (seconds, None if the phase was not reached), the number of probes
+    and the bytes sent and received.
+    """
+    writes = [(t, data) for t, kind, data in events if kind == EV_WRITE]
+    reads = [(t, data) for t, kind, data in events if (kind == EV_READ) and data]
+    res = {
+        "total": events[-1][0] if events else 0.0,
+        "handshake": None,
+        "transfer": None,
+        "ack": None,
+        "probes": sum(1 for t, data in writes if len(data) == 1),
+        "bytes_out": sum(len(data) for t, data in writes),
+        "bytes_in": sum(len(data) for t, data in reads),
+    }
+
+    frame = [t for t, data in writes if len(data) > 1]
+    if frame:
+        # Upload: the controller got ready with the last reply before the frame
+        ready = [t for t, data in reads if t <= frame[0]]
+        if ready:
+            res["handshake"] = ready[-1]
+            res["transfer"] = frame[0] - ready[-1]
+        acks = [t for t, data in reads if t > frame[0]]
+        if acks:
+            res["ack"] = acks[-1] - frame[0]
+    elif writes and reads:
+        # Download: the data starts coming after the last query
+        query = [t for t, data in writes if t <= reads[-1][0]]
+        if query:
+            start = min(t for t, data in reads if t >= query[-1])
+            res["handshake"] = start
+            res["transfer"] = reads[-1][0] - start
+    return res
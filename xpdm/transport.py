@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+# asyncio serial transport and the controller upload/download protocols
+#
+# asyncio is imported only when an asynchronous session is started, so
+# that the command line interface starts quickly
+#
+
+import os
+import threading
+from functools import reduce
+from operator import xor
+from xpdm import handshake, infineon
+
+# How long to wait for a reply byte before polling progress_func, seconds
+REPLY_TIMEOUT = 0.2
+
+# Serial polling interval on platforms where the port can't be selected on
+POLL_INTERVAL = 0.02
+
+# How many times to ask again for a frame with a bad checksum
+FRAME_RETRIES = 5
+
+
+class SerialTransport:
+    """A non-blocking reader for a serialpool.Session. Incoming data
+    is collected by the event loop as it arrives (through add_reader() on
+    the port file descriptor, or by polling where that's not supported),
+    and read() waits for it without blocking the loop.
+    """
+
+    def __init__(self, ser):
+        import asyncio
+
+        self.Serial = ser
+        self.Loop = asyncio.get_running_loop()
+        self.Buffer = bytearray()
+        self.Ready = asyncio.Event()
+        self.Error = None
+        self.Fd = None
+        self.Poller = None
+
+        try:
+            fd = ser.fileno()
+            os.set_blocking(fd, False)
+            self.Loop.add_reader(fd, self.on_Readable)
+            self.Fd = fd
+        except (AttributeError, NotImplementedError, OSError):
+            ser.timeout = 0
+            self.Poller = self.Loop.call_later(POLL_INTERVAL, self.Poll)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        if self.Fd is not None:
+            self.Loop.remove_reader(self.Fd)
+            self.Fd = None
+        if self.Poller is not None:
+            self.Poller.cancel()
+            self.Poller = None
+        # Returns the port to the serialpool
+        self.Serial.close()
+
+    def Received(self, data):
+        self.Buffer.extend(data)
+        self.Ready.set()
+
+    def Failed(self, e):
+        self.Error = e
+        # Don't hand the port out again
+        self.Serial.Broken = True
+        self.Ready.set()
+        if self.Fd is not None:
+            self.Loop.remove_reader(self.Fd)
+            self.Fd = None
+
+    def on_Readable(self):
+        try:
+            data = os.read(self.Fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self.Failed(e)
+            return
+        if not data:
+            self.Failed(IOError(_("Serial port was closed")))
+            return
+        # Read bypassing the session, let it know
+        self.Serial.Received(data)
+        self.Received(data)
+
+    def Poll(self):
+        try:
+            n = self.Serial.inWaiting()
+            if n:
+                self.Received(self.Serial.read(n))
+        except Exception as e:
+            self.Poller = None
+            self.Failed(e)
+            return
+        self.Poller = self.Loop.call_later(POLL_INTERVAL, self.Poll)
+
+    async def Wait(self, timeout):
+        """Wait until some data is received or timeout seconds pass"""
+        import asyncio
+
+        if (not self.Buffer) and (self.Error is None):
+            self.Ready.clear()
+            try:
+                await asyncio.wait_for(self.Ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        if self.Error is not None:
+            raise self.Error
+
+    async def read(self, size=1, timeout=REPLY_TIMEOUT):
+        """Return up to size received bytes, or b"" if nothing arrives
+        within timeout seconds
+        """
+        await self.Wait(timeout)
+
+        data = bytes(self.Buffer[:size])
+        del self.Buffer[:size]
+        return data
+
+    async def readinto(self, buf, timeout=REPLY_TIMEOUT):
+        """Fill buf with as much received data as is available, waiting up
+        to timeout seconds for the first byte; returns the byte count
+        """
+        await self.Wait(timeout)
+
+        n = min(len(buf), len(self.Buffer))
+        buf[:n] = self.Buffer[:n]
+        del self.Buffer[:n]
+        return n
+
+    def write(self, data):
+        self.Serial.write(data)
+
+    def flushInput(self):
+        self.Serial.flushInput()
+        del self.Buffer[:]
+
+
+class BlockingTransport:
+    """The SerialTransport interface on top of a blocking serial port,
+    for the synchronous entry points. Reads block on the port instead of
+    suspending, so the protocol coroutines can be run by RunSync()
+    without an event loop.
+    """
+
+    def __init__(self, ser):
+        self.Serial = ser
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def close(self):
+        self.Serial.close()
+
+    async def read(self, size=1, timeout=REPLY_TIMEOUT):
+        self.Serial.timeout = timeout
+        return self.Serial.read(size)
+
+    async def readinto(self, buf, timeout=REPLY_TIMEOUT):
+        # Returns as soon as buf is full, or on timeout
+        self.Serial.timeout = timeout
+        return self.Serial.readinto(buf)
+
+    def write(self, data):
+        self.Serial.write(data)
+
+    def flushInput(self):
+        self.Serial.flushInput()
+
+
+def Open(prof, com_port):
+    """Open the serial port with the framing of the profile's family"""
+    return SerialTransport(prof.OpenSerial(com_port))
+
+
+def OpenBlocking(prof, com_port):
+    """Open the serial port for a synchronous session"""
+    return BlockingTransport(prof.OpenSerial(com_port))
+
+
+def RunSync(coro):
+    """Run a protocol coroutine on a BlockingTransport to completion and
+    return its result
+    """
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+    coro.close()
+    raise RuntimeError("blocking serial session suspended")
+
+
+async def WaitReady(ser, query, ready, progress_func, sched):
+    """Send the query byte and wait for the ready byte in reply, following
+    the handshake.Schedule; returns False if progress_func asks to stop
+    waiting
+    """
+    skip_write = False
+    while True:
+        timeout = sched.Next()
+        if not skip_write:
+            # Garbage often comes from the controller upon bootup, just ignore it
+            ser.flushInput()
+            ser.write(query)
+            sched.Sent()
+        skip_write = False
+
+        c = await ser.read(timeout=timeout)
+        if c == ready:
+            sched.Ready()
+            return True
+
+        if len(c) > 0:
+            skip_write = True
+
+        if not progress_func():
+            return False
+
+
+# Common code for EB3xx and KH6xx
+async def SendRaw_EB3xx_KH6xx(prof, ser, com_port, data, progress_func):
+    progress_func(msg=_("Waiting for controller ready"))
+    # Send '8's and wait for the 'U' response
+    if not await WaitReady(ser, b'8', b'U', progress_func,
+                           handshake.Schedule(prof.Family, com_port)):
+        return False
+
+    progress_func(msg=_("Waiting acknowledgement"))
+
+    ser.flushInput()
+    ser.write(bytes(data))
+    ack = b"QR"
+    for i in range(10):
+        c = await ser.read()
+        while len(c) and (c[0] == ack[0]):
+            c = c[1:]
+            ack = ack[1:]
+            if len(ack) == 0:
+                return True
+
+        if len(c) > 0:
+            if c[0] == 0xa1:
+                raise Exception(_("Controller says data is short (wrong family?)"))
+            elif c[0] == 0xa2:
+                raise Exception(_("Controller says received data is broken"))
+            raise Exception(_("Invalid reply byte '%(chr)02x'") % {"chr": c[0]})
+
+        if not progress_func():
+            break
+
+    raise Exception(_("Controller does not acknowledge data"))
+
+
+async def ReceiveRaw_EB3xx_KH6xx(prof, ser, progress_func, query=False, tries=None):
+    """Read the image from the controller, querying it with 'U' after
+    every silence, up to tries times; a frame with a bad XOR checksum is
+    asked for again, up to FRAME_RETRIES times. Returns None if
+    progress_func asks to stop
+    """
+    # The frame is received right into its final buffer, in chunks
+    data = bytearray(prof.Codec.Length)
+    view = memoryview(data)
+    n = 0
+    retries = FRAME_RETRIES
+
+    while n < len(data):
+        if query:
+            if tries is not None:
+                if tries <= 0:
+                    raise Exception(_("Controller does not send its settings"))
+                tries -= 1
+            ser.flushInput()
+            ser.write(b'U')
+            query = False
+
+        got = await ser.readinto(view[n:])
+        if not got:
+            # Silence: a partial frame is stale, ask again
+            query = True
+            n = 0
+            if not progress_func():
+                return None
+        else:
+            n += got
+            if not progress_func(pos=(float(n) / len(data))):
+                return None
+
+        if (n == len(data)) and (reduce(xor, data, 0) != 0):
+            if retries <= 0:
+                raise Exception(_("Broken data received (wrong family?)"))
+            retries -= 1
+            # Let the rest of a broken frame pass, then ask again
+            while await ser.readinto(view):
+                if not progress_func():
+                    return None
+            query = True
+            n = 0
+
+    return data
+
+
+async def Upload_EB3xx_KH6xx(prof, com_port, progress_func, opener=Open):
+    data = prof.BuildRaw()
+    with opener(prof, com_port) as ser:
+        return await SendRaw_EB3xx_KH6xx(prof, ser, com_port, data, progress_func)
+
+
+async def Download_EB3xx_KH6xx(prof, com_port, progress_func, name_wildcard, opener=Open):
+    with opener(prof, com_port) as ser:
+        progress_func(msg=_("Waiting for controller ready"))
+        # Send 'U' and wait for response
+        data = await ReceiveRaw_EB3xx_KH6xx(prof, ser, progress_func)
+    if data is None:
+        return False
+
+    return prof.LoadRaw(data, name_wildcard)
+
+
+async def UploadVerify_EB3xx_KH6xx(prof, com_port, progress_func, opener=Open):
+    """Upload the profile and read it back in the same session; raises
+    VerifyError if the controller did not take the settings
+    """
+    data = prof.BuildRaw()
+    with opener(prof, com_port) as ser:
+        if not await SendRaw_EB3xx_KH6xx(prof, ser, com_port, data, progress_func):
+            return False
+
+        progress_func(msg=_("Reading back settings"))
+        back = await ReceiveRaw_EB3xx_KH6xx(prof, ser, progress_func, True,
+                                            infineon.VERIFY_QUERIES)
+    if back is None:
+        return False
+
+    return prof.VerifyRaw(data, back)
+
+
+async def Upload_EB2xx(prof, com_port, progress_func, opener=Open):
+    data = prof.BuildRaw()
+    with opener(prof, com_port) as ser:
+        progress_func(msg=_("Waiting for controller ready"))
+        # Send '8's and wait for the 'U' response
+        if not await WaitReady(ser, b'8', b'U', progress_func,
+                               handshake.Schedule(prof.Family, com_port)):
+            return False
+
+        progress_func(msg=_("Waiting acknowledgement"))
+        ser.flushInput()
+        ser.write(bytes(data))
+        for i in range(10):
+            c = await ser.read()
+            if c == b'U':
+                return True
+
+            if len(c) > 0:
+                raise Exception(_("Invalid reply byte '%(chr)02x'") % {"chr": c[0]})
+
+            if not progress_func():
+                break
+
+    return False
+
+
+class SessionLoop:
+    """An asyncio event loop running in a thread of its own, which can
+    drive any number of serial sessions at once. Completion callbacks
+    are passed to Dispatch to be run in the caller's context, e.g. with
+    Dispatch=glib.idle_add the GTK main loop runs them, so the GUI does
+    not have to spin nested main loops while a transfer is in progress.
+    """
+
+    def __init__(self, Dispatch=None):
+        import asyncio
+
+        self.Dispatch = Dispatch
+        self.Loop = asyncio.new_event_loop()
+        self.Thread = threading.Thread(target=self.Loop.run_forever,
+                                       name="xpd-serial", daemon=True)
+        self.Thread.start()
+
+    def Post(self, func, *args):
+        """Run func(*args) through Dispatch, or right away without one"""
+        if self.Dispatch is None:
+            func(*args)
+        else:
+            self.Dispatch(self.Call, func, args)
+
+    def Call(self, func, args):
+        func(*args)
+        # Don't let glib.idle_add() repeat the call
+        return False
+
+    def Submit(self, coro, callback=None):
+        """Start a coroutine in the loop; callback(result, error) is
+        posted when it finishes, error being None on success. Returns
+        a concurrent.futures.Future which can be used to cancel it.
+        """
+        import asyncio
+
+        fut = asyncio.run_coroutine_threadsafe(coro, self.Loop)
+        if callback is not None:
+            fut.add_done_callback(lambda f: self.Post(self.Finished, callback, f))
+        return fut
+
+    def Finished(self, callback, fut):
+        if fut.cancelled():
+            callback(False, None)
+        elif fut.exception() is not None:
+            callback(None, fut.exception())
+        else:
+            callback(fut.result(), None)
+
+    def Close(self):
+        self.Loop.call_soon_threadsafe(self.Loop.stop)
+        self.Thread.join()
+        self.Loop.close()
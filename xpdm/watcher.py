@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Profile directory watcher: reports added, changed, removed and
+# renamed .asv files through GIO file monitors (inotify on Linux)
+#
+
+import os
+import glib
+import gio
+from fnmatch import fnmatchcase
+
+# How long to wait for more events on the same file before reporting it, ms
+SETTLE_TIME = 250
+
+
+class ProfileWatcher:
+    """Watches a set of profile directories and calls Callback(FileName)
+    once for every .asv file which was created, modified, deleted or
+    renamed. Bursts of events on the same file are coalesced; the callback
+    should check whether the file still exists.
+    """
+
+    def __init__(self, Dirs, Callback):
+        self.Callback = Callback
+        self.Pending = set()
+        self.Timer = None
+        self.Monitors = []
+        self.Unwatched = []
+        for d in Dirs:
+            try:
+                mon = gio.File(d).monitor_directory(gio.FILE_MONITOR_SEND_MOVED)
+            except gio.Error as e:
+                print("Cannot watch directory %s: %s" % (d, e))
+                self.Unwatched.append(d)
+                continue
+            mon.connect("changed", self.on_Monitor_changed, d)
+            self.Monitors.append(mon)
+
+    def Active(self):
+        """True if every directory is watched; otherwise changes in some of
+        them are missed and the caller has to rescan them itself
+        """
+        return (len(self.Monitors) > 0) and not self.Unwatched
+
+    def Close(self):
+        for mon in self.Monitors:
+            mon.cancel()
+        self.Monitors = []
+        if self.Timer is not None:
+            glib.source_remove(self.Timer)
+            self.Timer = None
+
+    def Queue(self, d, gfile):
+        if gfile is None:
+            return
+        name = gfile.get_basename()
+        if not fnmatchcase(name, "*.asv"):
+            return
+
+        self.Pending.add(os.path.join(d, name))
+        if self.Timer is None:
+            self.Timer = glib.timeout_add(SETTLE_TIME, self.Flush)
+
+    def Flush(self):
+        self.Timer = None
+        pending = self.Pending
+        self.Pending = set()
+        for fn in sorted(pending):
+            self.Callback(fn)
+        return False
+
+    def on_Monitor_changed(self, mon, gfile, other, event, d):
+        if event in (gio.FILE_MONITOR_EVENT_CREATED,
+                     gio.FILE_MONITOR_EVENT_CHANGES_DONE_HINT,
+                     gio.FILE_MONITOR_EVENT_DELETED):
+            self.Queue(d, gfile)
+        elif event == gio.FILE_MONITOR_EVENT_MOVED:
+            # A rename inside the directory: old name gone, new name appeared
+            self.Queue(d, gfile)
+            if (other is not None) and (other.get_parent() is not None) and \
+               (other.get_parent().equal(gfile.get_parent())):
+                self.Queue(d, other)